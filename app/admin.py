@@ -0,0 +1,86 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Rotas de administração, em /admin/.
+
+Só existem quando ``FLASK_ADMIN_TOKEN`` está definido, e exigem o cabeçalho
+``Authorization: Bearer <token>``.
+"""
+import hmac
+
+from flask import Blueprint, abort, current_app, jsonify, request
+
+import pgss
+from cache import cache, invalidar_clinicas, invalidar_especialidades
+from db import get_db
+from preparadas import registo
+
+bp = Blueprint("admin", __name__, url_prefix="/admin")
+
+
+@bp.before_request
+def exige_token():
+    token = current_app.config.get("ADMIN_TOKEN")
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        abort(401)
+
+
+@bp.route("/cache/", methods=("GET",))
+def cache_view():
+    """Hits, misses e backend da cache deste processo."""
+    return jsonify(cache.estatisticas())
+
+
+@bp.route("/cache/invalidar/", methods=("POST",))
+def cache_invalidar():
+    """Invalida as listagens em cache; com ``{"clinica": ...}`` invalida só as
+    especialidades dessa clínica."""
+    clinica = (request.get_json(silent=True) or {}).get("clinica")
+    if clinica is None:
+        invalidar_clinicas()
+    invalidar_especialidades(clinica)
+    return jsonify({"Status": "Success"})
+
+
+@bp.route("/sql/", methods=("GET",))
+def sql_view():
+    """Execuções, erros e tempos de cada query preparada deste processo."""
+    return jsonify(registo.estatisticas())
+
+
+@bp.route("/sql/reiniciar/", methods=("POST",))
+def sql_reiniciar():
+    """Põe a zero os contadores das queries preparadas."""
+    registo.reiniciar()
+    return jsonify({"Status": "Success"})
+
+
+@bp.route("/pgss/snapshots/", methods=("GET",))
+def pgss_snapshots_view():
+    """Últimas fotografias do pg_stat_statements."""
+    with get_db().cursor() as cur:
+        return jsonify([s._asdict() for s in pgss.snapshots(cur)])
+
+
+@bp.route("/pgss/snapshots/", methods=("POST",))
+def pgss_snapshot():
+    """Tira uma fotografia; ``{"nome": ...}`` opcional."""
+    nome = (request.get_json(silent=True) or {}).get("nome")
+    with get_db().cursor() as cur:
+        return jsonify(pgss.tirar_snapshot(cur, nome)._asdict())
+
+
+@bp.route("/pgss/relatorio/", methods=("GET",))
+def pgss_relatorio():
+    """Statements mais pesados entre as fotografias ``de`` e ``ate`` (ou
+    agora), com ``ordem`` total ou media e ``limite`` linhas."""
+    try:
+        de = int(request.args["de"])
+        ate = int(request.args["ate"]) if "ate" in request.args else None
+        limite = int(request.args.get("limite", 20))
+    except (KeyError, ValueError):
+        return jsonify({"error": "Indique a fotografia inicial em de (e opcionalmente ate)."}), 400
+    ordem = "media" if request.args.get("ordem") == "media" else "total"
+    with get_db().cursor() as cur:
+        return jsonify(pgss.relatorio(cur, de, ate, ordem, limite))
@@ -0,0 +1,212 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Controlo de admissão dos pedidos, à frente do pool de ligações.
+
+Cada worker admite no máximo ``ADMISSAO_CAPACIDADE`` pedidos em curso (por
+omissão, o tamanho do pool). Os que chegam com a capacidade esgotada esperam
+numa fila curta, de ``ADMISSAO_FILA`` pedidos ao todo, no máximo
+``ADMISSAO_ESPERA`` segundos; com a fila cheia, ou passado esse tempo, a
+resposta é logo um 503 com ``Retry-After``, em vez de o pedido esperar pelo
+timeout do pool e de os seguintes se acumularem atrás dele.
+
+A admissão só vê os pedidos que o servidor já entregou a uma thread: o
+worker precisa de mais threads do que a capacidade mais a fila, para os
+pedidos a mais chegarem aqui e serem rejeitados, em vez de esperarem na fila
+do próprio servidor (gunicorn.conf.py dimensiona as threads assim).
+
+As rotas estão em classes, por ordem de prioridade:
+
+* ``cache``: listagens servidas pela cache (/, /c/<clinica>/), baratas;
+* ``escrita``: marcações e cancelamentos;
+* ``vagas`` e ``consultas``: disponibilidade e listagem de consultas, as
+  queries mais caras.
+
+Quando um pedido acaba, a vaga vai para o pedido em espera da classe mais
+prioritária. As classes caras nunca ocupam as últimas ``ADMISSAO_RESERVA``
+vagas, que ficam para as outras. As rotas fora das classes (admin, /metrics)
+não passam pela admissão.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import defaultdict
+
+from flask import g, jsonify, request
+
+import db
+
+ADMISSAO_ATIVA = os.environ.get("ADMISSAO_ATIVA", "1") != "0"
+ADMISSAO_CAPACIDADE = int(os.environ.get("ADMISSAO_CAPACIDADE", db.DATABASE_POOL_MAX_SIZE))
+ADMISSAO_FILA = int(os.environ.get("ADMISSAO_FILA", ADMISSAO_CAPACIDADE))
+ADMISSAO_ESPERA = float(os.environ.get("ADMISSAO_ESPERA", 1))
+ADMISSAO_RESERVA = int(os.environ.get("ADMISSAO_RESERVA", max(1, ADMISSAO_CAPACIDADE // 5)))
+ADMISSAO_RETRY_AFTER = int(os.environ.get("ADMISSAO_RETRY_AFTER", 1))
+
+
+class Classe:
+    def __init__(self, nome, prioridade, limite):
+        self.nome = nome
+        self.prioridade = prioridade
+        self.limite = limite
+
+
+CLASSES = {
+    c.nome: c
+    for c in (
+        Classe("cache", 0, ADMISSAO_CAPACIDADE),
+        Classe("escrita", 1, ADMISSAO_CAPACIDADE),
+        Classe("vagas", 2, max(1, ADMISSAO_CAPACIDADE - ADMISSAO_RESERVA)),
+        Classe("consultas", 2, max(1, ADMISSAO_CAPACIDADE - ADMISSAO_RESERVA)),
+    )
+}
+
+ROTAS = {
+    "clinicas_view": "cache",
+    "clinica_especialidade_view": "cache",
+    "registar": "escrita",
+    "registar_lote": "escrita",
+    "cancelar_marcacao": "escrita",
+    "cancelar_lote": "escrita",
+    "medicos_na_clinica": "vagas",
+    "consultas_da_clinica": "consultas",
+}
+
+
+class _Espera:
+    __slots__ = ("classe", "admitido", "desistiu")
+
+    def __init__(self, classe):
+        self.classe = classe
+        self.admitido = False
+        self.desistiu = False
+
+
+class Porta:
+    """Os pedidos em curso e em espera de um worker."""
+
+    def __init__(self, capacidade=ADMISSAO_CAPACIDADE, fila=ADMISSAO_FILA, espera=ADMISSAO_ESPERA):
+        self.capacidade = capacidade
+        self.fila = fila
+        self.espera = espera
+        self.em_curso = 0
+        self.em_espera = 0
+        self._cond = threading.Condition()
+        self._em_curso = defaultdict(int)
+        self._em_espera = defaultdict(int)
+        self._esperas = []  # heap de (prioridade, ordem de chegada, _Espera)
+        self._ordem = itertools.count()
+        self.admitidos = defaultdict(int)
+        self.rejeitados = defaultdict(int)
+
+    def _cabe(self, classe):
+        return self.em_curso < self.capacidade and self._em_curso[classe.nome] < classe.limite
+
+    def _ocupar(self, classe):
+        self.em_curso += 1
+        self._em_curso[classe.nome] += 1
+        self.admitidos[classe.nome] += 1
+
+    def _passar_vez(self):
+        """Admite os pedidos em espera que cabem, por ordem de prioridade."""
+        adiados = []
+        while self._esperas and self.em_curso < self.capacidade:
+            item = heapq.heappop(self._esperas)
+            espera = item[2]
+            if espera.desistiu:
+                continue
+            if not self._cabe(espera.classe):
+                adiados.append(item)
+                continue
+            espera.admitido = True
+            self.em_espera -= 1
+            self._em_espera[espera.classe.nome] -= 1
+            self._ocupar(espera.classe)
+        for item in adiados:
+            heapq.heappush(self._esperas, item)
+        self._cond.notify_all()
+
+    def entrar(self, classe):
+        """Ocupa uma vaga para um pedido de ``classe``; devolve False se o
+        pedido deve ser rejeitado (fila cheia ou espera esgotada)."""
+        with self._cond:
+            if not self._esperas and self._cabe(classe):
+                self._ocupar(classe)
+                return True
+            if self.em_espera >= self.fila:
+                self.rejeitados[classe.nome] += 1
+                return False
+            espera = _Espera(classe)
+            self.em_espera += 1
+            self._em_espera[classe.nome] += 1
+            heapq.heappush(self._esperas, (classe.prioridade, next(self._ordem), espera))
+            # Pode haver vagas que os pedidos à frente (de classes no limite) não podem usar.
+            self._passar_vez()
+            if not self._cond.wait_for(lambda: espera.admitido, self.espera):
+                espera.desistiu = True
+                self.em_espera -= 1
+                self._em_espera[classe.nome] -= 1
+                self.rejeitados[classe.nome] += 1
+                return False
+            return True
+
+    def sair(self, classe):
+        with self._cond:
+            self.em_curso -= 1
+            self._em_curso[classe.nome] -= 1
+            self._passar_vez()
+
+    def estatisticas(self):
+        with self._cond:
+            return {
+                nome: {
+                    "em_curso": self._em_curso[nome],
+                    "em_espera": self._em_espera[nome],
+                    "admitidos": self.admitidos[nome],
+                    "rejeitados": self.rejeitados[nome],
+                }
+                for nome in CLASSES
+            }
+
+
+porta = Porta()
+
+
+def _admitir():
+    classe = CLASSES.get(ROTAS.get(request.endpoint))
+    if classe is None:
+        return None
+    inicio = time.perf_counter()
+    if not porta.entrar(classe):
+        resposta = jsonify({"error": "Servidor sobrecarregado; tente de novo."})
+        resposta.status_code = 503
+        resposta.headers["Retry-After"] = str(ADMISSAO_RETRY_AFTER)
+        return resposta
+    g.admissao = classe
+    g.admissao_espera = time.perf_counter() - inicio
+    return None
+
+
+def _entregar(resposta):
+    """A vaga só é libertada quando a resposta acaba de ser enviada: a
+    exportação NDJSON continua a ler da base de dados depois da rota."""
+    classe = g.pop("admissao", None)
+    if classe is not None:
+        resposta.call_on_close(lambda: porta.sair(classe))
+    return resposta
+
+
+def _libertar(e=None):
+    """Liberta a vaga dos pedidos que acabaram sem passar por ``_entregar``."""
+    classe = g.pop("admissao", None)
+    if classe is not None:
+        porta.sair(classe)
+
+
+def init_app(app):
+    if not ADMISSAO_ATIVA:
+        return
+    app.before_request(_admitir)
+    app.after_request(_entregar)
+    app.teardown_request(_libertar)
@@ -0,0 +1,186 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Agenda de médicos e pacientes em bitsets.
+
+Um dia de consultas tem 20 horários (a grelha ``GRELHA``),
+por isso a ocupação de uma pessoa num dia cabe num inteiro: o bit ``i`` está
+a 1 se o horário ``GRELHA[i]`` estiver ocupado. Cada pessoa tem um
+``array('I')`` com um inteiro por dia do período da agenda, o que dá
+verificações de conflito em O(1) e varrimentos rápidos dos primeiros
+horários livres. Com o NumPy instalado, as consultas por intervalo de dias
+são vetorizadas sobre o mesmo buffer.
+
+A API usa-a no modo ``agenda`` da disponibilidade e os geradores de dados
+(levedura.py) para não marcarem duas consultas à mesma hora; por isso este
+módulo só depende do psycopg dentro de ``Agenda.carregar``.
+"""
+from array import array
+from datetime import date, datetime, time, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # O NumPy é opcional: sem ele as consultas por intervalo são em Python.
+    np = None
+
+# Grelha das consultas, a mesma do generate_time do levedura.py:
+# 08:00–12:30 e 14:00–18:30, de meia em meia hora.
+GRELHA = tuple(
+    time(hora, minuto)
+    for hora in (*range(8, 13), *range(14, 19))
+    for minuto in (0, 30)
+)
+
+SLOTS_POR_DIA = len(GRELHA)
+CHEIO = (1 << SLOTS_POR_DIA) - 1
+SLOT = {hora: i for i, hora in enumerate(GRELHA)}
+
+
+def _dia_semana(data):
+    # Domingo = 0, como em trabalha.dia_da_semana e EXTRACT(DOW ...).
+    return data.isoweekday() % 7
+
+
+def _popcount(valores):
+    if np is None:
+        return [bin(v).count("1") for v in valores]
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(valores)
+    return np.unpackbits(valores.view(np.uint8).reshape(-1, 4), axis=1).sum(axis=1)
+
+
+class Agenda:
+    """Ocupação de um conjunto de pessoas entre ``inicio`` e ``inicio + dias - 1``.
+
+    As pessoas são identificadas por qualquer chave (nif, ssn, ...); as horas
+    têm de pertencer à grelha de consultas.
+    """
+
+    def __init__(self, inicio, dias):
+        self.inicio = inicio.date() if isinstance(inicio, datetime) else inicio
+        self.dias = dias
+        self._linhas = {}
+        self._vazia = array("I", [0]) * dias
+
+    def _indice(self, data):
+        if isinstance(data, datetime):
+            data = data.date()
+        elif isinstance(data, str):
+            data = date.fromisoformat(data)
+        i = (data - self.inicio).days
+        if not 0 <= i < self.dias:
+            raise IndexError(f"{data} fora da agenda")
+        return i
+
+    def _linha(self, pessoa):
+        linha = self._linhas.get(pessoa)
+        if linha is None:
+            linha = self._linhas[pessoa] = array("I", self._vazia)
+        return linha
+
+    def mascara(self, pessoa, data):
+        return self._linhas.get(pessoa, self._vazia)[self._indice(data)]
+
+    def ocupado(self, pessoa, data, hora):
+        return bool(self.mascara(pessoa, data) >> SLOT[hora] & 1)
+
+    def ocupar(self, pessoa, data, hora):
+        """Marca o horário como ocupado; devolve False se já estava."""
+        linha, i, bit = self._linha(pessoa), self._indice(data), 1 << SLOT[hora]
+        if linha[i] & bit:
+            return False
+        linha[i] |= bit
+        return True
+
+    def libertar(self, pessoa, data, hora):
+        linha, i = self._linha(pessoa), self._indice(data)
+        linha[i] &= ~(1 << SLOT[hora]) & CHEIO
+
+    def ocupar_mascara(self, pessoa, data, mascara):
+        self._linha(pessoa)[self._indice(data)] |= mascara & CHEIO
+
+    def livres(self, pessoa, data):
+        """Horários livres da pessoa nesse dia."""
+        m = self.mascara(pessoa, data)
+        return [hora for i, hora in enumerate(GRELHA) if not m >> i & 1]
+
+    def ocupacao(self, pessoa, de, ate):
+        """Número de horários ocupados por dia, de ``de`` a ``ate`` inclusive."""
+        i, j = self._indice(de), self._indice(ate) + 1
+        linha = self._linhas.get(pessoa, self._vazia)
+        if np is None:
+            return _popcount(linha[i:j])
+        return _popcount(np.frombuffer(linha, dtype=np.uint32)[i:j])
+
+    def _dias_com_vaga(self, linha, i, dias_semana):
+        """Índices dos dias a partir de ``i`` com algum horário livre num dos
+        ``dias_semana`` (todos, se for None)."""
+        if np is None:
+            for k in range(i, self.dias):
+                if linha[k] != CHEIO and (
+                    dias_semana is None or _dia_semana(self.inicio + timedelta(days=k)) in dias_semana
+                ):
+                    yield k
+            return
+        valores = np.frombuffer(linha, dtype=np.uint32)[i:]
+        candidatos = valores != CHEIO
+        if dias_semana is not None:
+            semana = (np.arange(i, self.dias) + _dia_semana(self.inicio)) % 7
+            candidatos &= np.isin(semana, list(dias_semana))
+        yield from (i + np.flatnonzero(candidatos)).tolist()
+
+    def primeiros_livres(self, pessoa, desde, n, dias_semana=None, depois_de=None):
+        """Primeiros ``n`` horários livres ``(data, hora)`` a partir do dia
+        ``desde``, só nos ``dias_semana`` indicados e, se ``depois_de`` for um
+        datetime, só depois dele."""
+        linha = self._linhas.get(pessoa, self._vazia)
+        resultado = []
+        for k in self._dias_com_vaga(linha, self._indice(desde), dias_semana):
+            data = self.inicio + timedelta(days=k)
+            livres = ~linha[k] & CHEIO
+            while livres:
+                bit = livres & -livres
+                livres ^= bit
+                hora = GRELHA[bit.bit_length() - 1]
+                if depois_de is not None and datetime.combine(data, hora) <= depois_de:
+                    continue
+                resultado.append((data, hora))
+                if len(resultado) == n:
+                    return resultado
+        return resultado
+
+    @classmethod
+    def carregar(cls, cur, inicio, dias, pessoa="nif", pessoas=None):
+        """Agenda com as consultas existentes entre ``inicio`` e ``inicio + dias
+        - 1``, por médico (``pessoa="nif"``) ou por paciente (``"ssn"``). As
+        máscaras são agregadas em SQL: uma linha por pessoa e por dia."""
+        from psycopg import sql
+
+        agenda = cls(inicio, dias)
+        coluna = sql.Identifier(pessoa)
+        filtro = sql.SQL("AND {} = ANY(%(pessoas)s)").format(coluna) if pessoas is not None else sql.SQL("")
+        linhas = cur.execute(
+            sql.SQL(MASCARAS).format(coluna=coluna, filtro=filtro),
+            {
+                "inicio": agenda.inicio,
+                "fim": agenda.inicio + timedelta(days=dias - 1),
+                "grelha": list(GRELHA),
+                "pessoas": list(pessoas) if pessoas is not None else None,
+            },
+        ).fetchall()
+        for r in linhas:
+            agenda.ocupar_mascara(r.pessoa, r.data, r.mascara)
+        return agenda
+
+
+MASCARAS = '''
+    SELECT
+        {coluna} AS pessoa,
+        data,
+        bit_or(1 << (array_position(%(grelha)s::time[], hora) - 1)) AS mascara
+    FROM consulta
+    WHERE
+        data BETWEEN %(inicio)s AND %(fim)s AND
+        hora = ANY(%(grelha)s::time[])
+        {filtro}
+    GROUP BY {coluna}, data;
+'''
@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Pedidos/s da versão WSGI (wsgi.py) contra a versão ASGI (asgi.py).
+
+Os dois servidores têm de estar a correr sobre a mesma base de dados, por
+exemplo:
+
+    gunicorn wsgi:app --bind 0.0.0.0:8080 --workers 2 --threads 8
+    uvicorn asgi:app --host 0.0.0.0 --port 8081 --workers 2
+
+e depois, a partir de app/:
+
+    python bench/asgi_vs_wsgi.py --clinica "Clinica X" --especialidade cardiologia
+
+Para cada número de clientes em ``--clientes`` corre a mesma carga contra
+cada servidor (a lista de clínicas, as especialidades de uma clínica e os
+horários livres de uma especialidade, escolhidos ao acaso) e mostra os
+pedidos/s e os percentis de latência.
+"""
+import argparse
+import asyncio
+import json
+import random
+from urllib.parse import quote
+
+from cliente import carga
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--wsgi", default="http://localhost:8080")
+    parser.add_argument("--asgi", default="http://localhost:8081")
+    parser.add_argument("--clientes", default="50,100,200,500", help="níveis de concorrência, separados por vírgulas")
+    parser.add_argument("--duracao", type=float, default=10, help="segundos por nível")
+    parser.add_argument("--clinica", required=True)
+    parser.add_argument("--especialidade", required=True)
+    parser.add_argument("--saida", help="ficheiro JSON com os resultados")
+    args = parser.parse_args()
+
+    clinica, especialidade = quote(args.clinica), quote(args.especialidade)
+    rotas = ["/", f"/c/{clinica}/", f"/c/{clinica}/{especialidade}/"]
+
+    def proximo_pedido():
+        return "GET", random.choice(rotas), None
+
+    resultados = []
+    print(f"{'servidor':8} {'clientes':>8} {'pedidos/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  estados")
+    for clientes in (int(c) for c in args.clientes.split(",")):
+        for servidor, base in (("wsgi", args.wsgi), ("asgi", args.asgi)):
+            r = {"servidor": servidor, **asyncio.run(carga(base, clientes, args.duracao, proximo_pedido))}
+            resultados.append(r)
+            print(
+                f"{servidor:8} {clientes:>8} {r['pedidos_por_segundo']:>10} "
+                f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8}  {r['estados']}"
+            )
+
+    if args.saida:
+        with open(args.saida, "w") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
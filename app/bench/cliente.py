@@ -0,0 +1,160 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Cliente HTTP/1.1 mínimo sobre asyncio para os benchmarks.
+
+Cada cliente mantém uma ligação keep-alive e faz um pedido de cada vez, como
+um browser ou um balcão de atendimento; só depende da biblioteca padrão para
+que o próprio cliente não seja o gargalo nem obrigue a instalar nada.
+"""
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+
+class Cliente:
+    def __init__(self, base):
+        url = urlsplit(base)
+        self.host = url.hostname
+        self.porta = url.port or 80
+        self.prefixo = url.path.rstrip("/")
+        self._leitor = self._escritor = None
+
+    async def _ligar(self):
+        self._leitor, self._escritor = await asyncio.open_connection(self.host, self.porta)
+
+    async def fechar(self):
+        if self._escritor is not None:
+            self._escritor.close()
+            try:
+                await self._escritor.wait_closed()
+            except OSError:
+                pass
+            self._leitor = self._escritor = None
+
+    async def pedido(self, metodo, caminho, corpo=None):
+        """Faz um pedido e devolve ``(estado, corpo em bytes)``; volta a ligar
+        uma vez se o servidor tiver fechado a ligação keep-alive."""
+        for tentativa in range(2):
+            if self._escritor is None:
+                await self._ligar()
+            try:
+                return await self._pedido(metodo, caminho, corpo)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                await self.fechar()
+                if tentativa:
+                    raise
+
+    async def _pedido(self, metodo, caminho, corpo):
+        dados = b"" if corpo is None else json.dumps(corpo).encode()
+        cabecalho = (
+            f"{metodo} {self.prefixo}{caminho} HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.porta}\r\n"
+            f"Content-Length: {len(dados)}\r\n"
+        )
+        if corpo is not None:
+            cabecalho += "Content-Type: application/json\r\n"
+        self._escritor.write(cabecalho.encode() + b"\r\n" + dados)
+        await self._escritor.drain()
+
+        linha = await self._leitor.readuntil(b"\r\n")
+        estado = int(linha.split()[1])
+        cabecalhos = {}
+        while (linha := await self._leitor.readuntil(b"\r\n")) != b"\r\n":
+            nome, _, valor = linha.decode("latin-1").partition(":")
+            cabecalhos[nome.strip().lower()] = valor.strip()
+
+        if cabecalhos.get("transfer-encoding", "").lower() == "chunked":
+            partes = []
+            while tamanho := int((await self._leitor.readuntil(b"\r\n")).split(b";")[0], 16):
+                partes.append(await self._leitor.readexactly(tamanho))
+                await self._leitor.readexactly(2)
+            await self._leitor.readuntil(b"\r\n")
+            resposta = b"".join(partes)
+        else:
+            resposta = await self._leitor.readexactly(int(cabecalhos.get("content-length", 0)))
+
+        if cabecalhos.get("connection", "").lower() == "close":
+            await self.fechar()
+        return estado, resposta
+
+
+def percentil(valores, p):
+    """Percentil ``p`` (0-100) de uma lista já ordenada, por interpolação."""
+    if not valores:
+        return None
+    k = (len(valores) - 1) * p / 100
+    i = int(k)
+    if i + 1 == len(valores):
+        return valores[i]
+    return valores[i] + (valores[i + 1] - valores[i]) * (k - i)
+
+
+def resumo(latencias, decorrido):
+    """Pedidos, pedidos/s e percentis de latência (ms) de uma lista de
+    latências em segundos, medidas ao longo de ``decorrido`` segundos."""
+    latencias = sorted(latencias)
+
+    def ms(p):
+        return round(percentil(latencias, p) * 1000, 2) if latencias else None
+
+    return {
+        "pedidos": len(latencias),
+        "pedidos_por_segundo": round(len(latencias) / decorrido, 1),
+        "p50_ms": ms(50),
+        "p95_ms": ms(95),
+        "p99_ms": ms(99),
+    }
+
+
+async def carga(base, clientes, duracao, proximo_pedido, ao_responder=None):
+    """Põe ``clientes`` clientes a fazer pedidos durante ``duracao`` segundos.
+
+    ``proximo_pedido()`` devolve ``(metodo, caminho, corpo)`` para cada pedido,
+    ou ``(metodo, caminho, corpo, etiqueta)`` para os resultados virem também
+    separados por etiqueta; ``ao_responder(pedido, estado, resposta)``, se
+    dado, recebe cada resposta. Devolve um dicionário com pedidos/s, estados
+    e percentis de latência (ms).
+    """
+    latencias, estados = [], {}
+    etiquetas = {}
+    fim = time.perf_counter() + duracao
+
+    async def um_cliente():
+        cliente = Cliente(base)
+        try:
+            while time.perf_counter() < fim:
+                pedido = proximo_pedido()
+                metodo, caminho, corpo = pedido[:3]
+                inicio = time.perf_counter()
+                try:
+                    estado, resposta = await cliente.pedido(metodo, caminho, corpo)
+                except OSError:
+                    estado, resposta = "ligacao", None
+                latencia = time.perf_counter() - inicio
+                latencias.append(latencia)
+                estados[estado] = estados.get(estado, 0) + 1
+                if len(pedido) > 3:
+                    e = etiquetas.setdefault(pedido[3], ([], {}))
+                    e[0].append(latencia)
+                    e[1][estado] = e[1].get(estado, 0) + 1
+                if ao_responder is not None:
+                    ao_responder(pedido, estado, resposta)
+        finally:
+            await cliente.fechar()
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(um_cliente() for _ in range(clientes)))
+    decorrido = time.perf_counter() - inicio
+
+    resultado = {"clientes": clientes, **resumo(latencias, decorrido), "estados": _estados(estados)}
+    if etiquetas:
+        resultado["etiquetas"] = {
+            etiqueta: {**resumo(l, decorrido), "estados": _estados(e)}
+            for etiqueta, (l, e) in sorted(etiquetas.items())
+        }
+    return resultado
+
+
+def _estados(estados):
+    return {str(e): n for e, n in sorted(estados.items(), key=str)}
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Marcações concorrentes dos mesmos horários (teste de contenção de registar).
+
+Em cada ronda escolhe ``--horarios`` horários livres de médicos (num dia e
+hora em que trabalham, nos próximos 30 dias) e dispara ao mesmo tempo
+``--clientes`` marcações, cada uma de um paciente diferente para um desses
+horários ao acaso. Por horário só uma marcação pode ganhar: as outras são
+recusadas pela validação (400, se o horário já estava marcado quando foi
+validada) ou pelo índice único (409, se passaram a validação ao mesmo tempo
+que a vencedora; ver migrations/0007_consulta_horario_unico.sql).
+
+No fim mostra os pedidos/s de todas as rondas, a latência por desfecho
+(``marcada``, ``ocupado_409``, ``recusada_400`` e ``outro``) e as marcações
+em duplicado, que têm de ser zero; depois cancela pela API as marcações que
+fez. Corre contra a API e a base de dados do teste de carga (bench/carga.py):
+
+    python bench/disputa.py --clientes 100 --horarios 5 --rondas 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from urllib.parse import quote
+
+import psycopg
+
+# carga põe app/ no sys.path, para o import de agenda.
+from carga import CATALOGO_HORARIOS, CATALOGO_PACIENTES, DATABASE_URL
+from cliente import Cliente, resumo
+
+from agenda import GRELHA
+
+DESFECHOS = {200: "marcada", 409: "ocupado_409", 400: "recusada_400"}
+
+
+def _horarios_da_ronda(aleatorio, horarios, usados, n):
+    """``n`` horários (clinica, nif, data, hora) ainda não usados no teste."""
+    proximos = [date.today() + timedelta(days=i) for i in range(1, 31)]
+    escolhidos = []
+    while len(escolhidos) < n:
+        nif, clinica, dia_da_semana = aleatorio.choice(horarios)
+        dias = [d for d in proximos if d.isoweekday() % 7 == dia_da_semana]
+        chave = (nif, aleatorio.choice(dias).isoformat(), aleatorio.choice(GRELHA).strftime("%H:%M:%S"))
+        if chave not in usados:
+            usados.add(chave)
+            escolhidos.append((clinica, *chave))
+    return escolhidos
+
+
+async def disputa(args, horarios, pacientes):
+    aleatorio = random.Random(args.semente)
+    clientes = [Cliente(args.base) for _ in range(args.clientes)]
+    # Abre as ligações antes da primeira ronda.
+    await asyncio.gather(*(c.pedido("GET", "/") for c in clientes))
+
+    latencias = {d: [] for d in (*DESFECHOS.values(), "outro")}
+    marcadas, usados = [], set()
+
+    async def marcar(cliente, clinica, nif, data, hora, ssn):
+        corpo = {"ssn paciente": ssn, "nif medico": nif, "data": data, "hora": hora}
+        inicio = time.perf_counter()
+        estado, resposta = await cliente.pedido("POST", f"/a/{quote(clinica)}/registar/", corpo)
+        latencia = time.perf_counter() - inicio
+        desfecho = DESFECHOS.get(estado, "outro")
+        if estado == 200 and b'"id"' not in resposta:
+            desfecho = "outro"
+        latencias[desfecho].append(latencia)
+        if desfecho == "marcada":
+            marcadas.append((clinica, corpo))
+
+    inicio = time.perf_counter()
+    for _ in range(args.rondas):
+        ronda = _horarios_da_ronda(aleatorio, horarios, usados, args.horarios)
+        ssns = aleatorio.sample(pacientes, args.clientes)
+        await asyncio.gather(*(
+            marcar(cliente, *aleatorio.choice(ronda), ssn)
+            for cliente, ssn in zip(clientes, ssns)
+        ))
+    decorrido = time.perf_counter() - inicio
+
+    por_horario = {}
+    for clinica, corpo in marcadas:
+        chave = (corpo["nif medico"], corpo["data"], corpo["hora"])
+        por_horario[chave] = por_horario.get(chave, 0) + 1
+
+    # Devolve os horários, pela própria API.
+    for clinica, corpo in marcadas:
+        await clientes[0].pedido("POST", f"/a/{quote(clinica)}/cancelar/", corpo)
+    for cliente in clientes:
+        await cliente.fechar()
+
+    todas = [l for valores in latencias.values() for l in valores]
+    return {
+        "configuracao": {
+            "base": args.base,
+            "clientes": args.clientes,
+            "horarios": args.horarios,
+            "rondas": args.rondas,
+            "semente": args.semente,
+        },
+        "total": resumo(todas, decorrido),
+        "desfechos": {d: resumo(l, decorrido) for d, l in latencias.items() if l},
+        "horarios_marcados": len(por_horario),
+        "duplicados": sum(n - 1 for n in por_horario.values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base", default="http://localhost:8080")
+    parser.add_argument("--dsn", default=DATABASE_URL, help="base de dados (por omissão, DATABASE_URL)")
+    parser.add_argument("--clientes", type=int, default=100, help="marcações simultâneas por ronda")
+    parser.add_argument("--horarios", type=int, default=5, help="horários disputados por ronda")
+    parser.add_argument("--rondas", type=int, default=50)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--saida", help="ficheiro JSON com os resultados")
+    args = parser.parse_args()
+
+    with psycopg.connect(args.dsn) as conn:
+        horarios = conn.execute(CATALOGO_HORARIOS).fetchall()
+        pacientes = [p[0] for p in conn.execute(CATALOGO_PACIENTES).fetchall()]
+    if len(pacientes) < args.clientes:
+        sys.exit(f"São precisos pelo menos {args.clientes} pacientes.")
+
+    r = asyncio.run(disputa(args, horarios, pacientes))
+
+    print(f"{'desfecho':14} {'pedidos':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for desfecho, d in (*r["desfechos"].items(), ("total", r["total"])):
+        print(f"{desfecho:14} {d['pedidos']:>8} {d['p50_ms']!s:>8} {d['p95_ms']!s:>8} {d['p99_ms']!s:>8}")
+    print(f"{r['total']['pedidos_por_segundo']} pedidos/s; {r['horarios_marcados']} horários marcados, {r['duplicados']} em duplicado.")
+
+    if args.saida:
+        os.makedirs(os.path.dirname(os.path.abspath(args.saida)), exist_ok=True)
+        with open(args.saida, "w") as f:
+            json.dump(r, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if r["duplicados"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Custo de serializar linhas da base de dados em JSON, por 10 mil linhas.
+
+Compara, para linhas como as de /c/<clinica>/<especialidade>/ (nif, medico,
+data, hora) e de /c/<clinica>/consultas/ (seis colunas), o tempo de
+``jsonify`` até aos bytes da resposta:
+
+* ``antes``: um dicionário por linha com ``isoformat``/``strftime`` e o
+  provedor JSON por omissão do Flask;
+* ``json``: as linhas tal como vêm do psycopg, com o provedor de
+  serializacao.py sem orjson;
+* ``orjson``: o mesmo, com orjson (se estiver instalado).
+
+Não precisa de base de dados nem de servidor. A partir de app/:
+
+    python bench/json_linhas.py --linhas 10000
+"""
+import argparse
+import os
+import sys
+import timeit
+from collections import namedtuple
+from datetime import date, time, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import serializacao
+
+Vaga = namedtuple("Vaga", "nif medico data hora")
+Consulta = namedtuple("Consulta", "id ssn nif data hora codigo_sns")
+
+
+def linhas_vagas(n):
+    return [
+        Vaga(f"{i % 1000:09d}", f"Médico {i % 1000}", date(2024, 1, 1) + timedelta(days=i % 30), time(8 + i % 10, 30 * (i % 2)))
+        for i in range(n)
+    ]
+
+
+def linhas_consultas(n):
+    return [
+        Consulta(i, f"{i:011d}", f"{i % 1000:09d}", date(2024, 1, 1) + timedelta(days=i % 365), time(8 + i % 10, 30 * (i % 2)), f"{i:012d}")
+        for i in range(n)
+    ]
+
+
+def antes_vagas(linhas):
+    return [
+        {"nif": v.nif, "medico": v.medico, "data": v.data.isoformat(), "hora": v.hora.strftime("%H:%M:%S")}
+        for v in linhas
+    ]
+
+
+def antes_consultas(linhas):
+    return [
+        {
+            "id": c.id, "ssn paciente": c.ssn, "nif medico": c.nif, "data": c.data.isoformat(),
+            "hora": c.hora.strftime("%H:%M:%S"), "codigo_sns": c.codigo_sns,
+        }
+        for c in linhas
+    ]
+
+
+def depois_consultas(linhas):
+    return [
+        {"id": c.id, "ssn paciente": c.ssn, "nif medico": c.nif, "data": c.data, "hora": c.hora, "codigo_sns": c.codigo_sns}
+        for c in linhas
+    ]
+
+
+def medir(app, preparar, linhas, repeticoes):
+    with app.test_request_context():
+        corpo = app.json.response(preparar(linhas)).get_data()
+        segundos = min(timeit.repeat(lambda: app.json.response(preparar(linhas)).get_data(), number=1, repeat=repeticoes))
+    return segundos, corpo
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--linhas", type=int, default=10000)
+    parser.add_argument("--repeticoes", type=int, default=20)
+    args = parser.parse_args()
+
+    antes = Flask("antes")
+    antes.json = DefaultJSONProvider(antes)
+    versoes = [("antes", antes, {"vagas": antes_vagas, "consultas": antes_consultas})]
+    for nome, rapido in (("json", False), ("orjson", True)):
+        if rapido and serializacao.orjson is None:
+            print("orjson não está instalado; sem a versão orjson.")
+            continue
+        app = Flask(nome)
+        app.json = serializacao.ProvedorJSON(app)
+        app.json.rapido = rapido
+        versoes.append((nome, app, {"vagas": list, "consultas": depois_consultas}))
+
+    escala = 10000 / args.linhas
+    print(f"{'linhas':10} {'versão':8} {'ms/10k linhas':>14} {'bytes/linha':>12}")
+    for tipo, gerar in (("vagas", linhas_vagas), ("consultas", linhas_consultas)):
+        linhas = gerar(args.linhas)
+        referencia = None
+        for nome, app, preparar in versoes:
+            segundos, corpo = medir(app, preparar[tipo], linhas, args.repeticoes)
+            ms = segundos * 1000 * escala
+            referencia = referencia or ms
+            print(f"{tipo:10} {nome:8} {ms:>14.2f} {len(corpo) / args.linhas:>12.1f}  ({referencia / ms:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Custo das métricas (metricas.py) por pedido.
+
+Mede com o cliente de testes do Flask, sem rede nem base de dados, o tempo
+médio de um pedido a uma rota que devolve uma lista de 50 objetos JSON, com
+e sem a instrumentação, e o custo de uma observação de histograma. Correr a
+partir de app/:
+
+    python bench/metricas.py --pedidos 20000
+"""
+import argparse
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify
+
+import metricas
+
+CORPO = [{"nif": f"{i:09d}", "medico": f"Médico {i}", "data": "2024-01-02", "hora": "09:30:00"} for i in range(50)]
+
+
+def aplicacao(instrumentada):
+    app = Flask(f"bench_{instrumentada}")
+    if instrumentada:
+        metricas.init_app(app)
+
+    @app.route("/c/<clinica>/<especialidade>/")
+    def vagas(clinica, especialidade):
+        return jsonify(CORPO)
+
+    return app
+
+
+def medir(app, pedidos):
+    cliente = app.test_client()
+    for _ in range(min(pedidos, 1000)):
+        cliente.get("/c/X/Y/")
+    inicio = time.perf_counter()
+    for _ in range(pedidos):
+        cliente.get("/c/X/Y/")
+    return (time.perf_counter() - inicio) / pedidos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pedidos", type=int, default=20000)
+    args = parser.parse_args()
+
+    sem = medir(aplicacao(False), args.pedidos)
+    com = medir(aplicacao(True), args.pedidos)
+    observacao = min(timeit.repeat(
+        lambda: metricas.latencia.observar(("/bench", "total"), 0.003), number=100000, repeat=5
+    )) / 100000
+
+    print(f"sem métricas:        {sem * 1e6:8.1f} µs/pedido")
+    print(f"com métricas:        {com * 1e6:8.1f} µs/pedido")
+    print(f"custo das métricas:  {(com - sem) * 1e6:8.1f} µs/pedido ({(com - sem) / sem:+.1%})")
+    print(f"uma observação:      {observacao * 1e6:8.2f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Cache de leitura (read-through) para as listagens que raramente mudam.
+
+Os valores vivem no Redis quando ``REDIS_URL`` está definido e o servidor
+responde; caso contrário, ou enquanto o Redis estiver em baixo, usa-se uma
+LRU em memória do próprio processo. As entradas expiram ao fim do TTL e podem
+ser invalidadas explicitamente pelos ganchos ``invalidar_*``.
+
+Os mesmos ganchos incrementam a versão de cada recurso afetado (listagem de
+clínicas, especialidades de uma clínica, vagas de uma especialidade numa
+clínica), que as rotas usam para os ETag e o Last-Modified (ver
+condicional.py). As versões também vivem no Redis, para serem as mesmas em
+todos os workers; sem Redis cada processo tem as suas, e o mesmo número
+pode querer dizer dados diferentes em workers diferentes (o worker que
+escreve conta a alteração duas vezes, uma logo e outra no aviso do
+Postgres, e um worker novo recomeça do zero). Por isso as versões locais
+vêm com a origem, um identificador de cada processo, que entra no ETag.
+
+``partilhar`` junta pedidos iguais feitos ao mesmo tempo (single-flight):
+enquanto a query de uma chave corre, os outros pedidos da mesma chave
+esperam por ela e recebem o mesmo resultado, que ainda é reutilizado durante
+``COALESCER_JANELA`` segundos. Entre threads de um worker chega um lock
+local; com Redis, um lock com TTL no Redis faz o mesmo entre workers.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+
+from serializacao import codificar
+
+try:
+    import redis
+except ImportError:  # O Redis é opcional: sem ele fica só a LRU local.
+    redis = None
+
+log = logging.getLogger(__name__)
+
+REDIS_URL = os.environ.get("REDIS_URL")
+CACHE_TTL = int(os.environ.get("CACHE_TTL", 300))
+CACHE_LRU_MAX = int(os.environ.get("CACHE_LRU_MAX", 1024))
+# Segundos durante os quais o resultado de uma query partilhada é reutilizado,
+# e o máximo que um pedido espera pela query de outro antes de a correr.
+COALESCER_JANELA = float(os.environ.get("COALESCER_JANELA", 1))
+COALESCER_ESPERA = float(os.environ.get("COALESCER_ESPERA", 5))
+
+# Segundos sem tentar o Redis depois de uma falha.
+_REDIS_PAUSA = 5
+_PREFIXO = "saude:cache:"
+_PREFIXO_VERSAO = "saude:versao:"
+_PREFIXO_VOO = "saude:voo:"
+# Identificador das versões guardadas no Redis (ver Cache.versoes).
+_EPOCA = "saude:versao-epoca"
+# Intervalo entre verificações de um pedido à espera da query de outro worker.
+_VOO_PAUSA = 0.01
+# Só apaga o lock se ainda for o de quem o criou.
+_LIBERTAR_VOO = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class LRU:
+    """LRU com TTL por entrada, segura entre threads."""
+
+    def __init__(self, tamanho):
+        self._tamanho = tamanho
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            entrada = self._dados.get(chave)
+            if entrada is None:
+                return None
+            if entrada[0] < time.monotonic():
+                del self._dados[chave]
+                return None
+            self._dados.move_to_end(chave)
+            return entrada
+
+    def set(self, chave, valor, ttl):
+        with self._lock:
+            self._dados[chave] = (time.monotonic() + ttl, valor)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self._tamanho:
+                self._dados.popitem(last=False)
+
+    def delete(self, chave):
+        with self._lock:
+            self._dados.pop(chave, None)
+
+    def delete_prefixo(self, prefixo):
+        with self._lock:
+            for chave in [c for c in self._dados if c.startswith(prefixo)]:
+                del self._dados[chave]
+
+
+class _Voo:
+    """Uma query em curso, à espera da qual podem estar outros pedidos."""
+
+    def __init__(self):
+        self.acabou = threading.Event()
+        self.valor = None
+        self.erro = None
+
+
+class Cache:
+    """Cache read-through com contadores de hits e misses por família de chaves.
+
+    A família é o que vem antes do primeiro ``:`` da chave (``clinicas``,
+    ``especialidades``, ...), para se poder dimensionar cada uma à parte.
+    """
+
+    def __init__(self, url=REDIS_URL, ttl=CACHE_TTL, tamanho=CACHE_LRU_MAX):
+        self.ttl = ttl
+        self._local = LRU(tamanho)
+        self._redis = None
+        if url and redis is not None:
+            self._redis = redis.Redis.from_url(url, socket_timeout=0.1, socket_connect_timeout=0.1)
+        self._redis_pausa_ate = 0.0
+        self._contadores = defaultdict(lambda: {"hits": 0, "misses": 0, "partilhados": 0})
+        self._voos = {}
+        self._versoes = {}
+        self._lock = threading.Lock()
+        self.renovar_origem()
+
+    def renovar_origem(self):
+        """Novo identificador das versões locais, em cada processo (também
+        depois de um fork, em que o filho herda o do pai)."""
+        self._origem = uuid.uuid4().hex
+
+    def _usa_redis(self):
+        return self._redis is not None and time.monotonic() >= self._redis_pausa_ate
+
+    def _falha_redis(self, erro):
+        log.warning(f"Redis indisponível, a usar a cache local: {erro}")
+        self._redis_pausa_ate = time.monotonic() + _REDIS_PAUSA
+
+    def _contar(self, chave, tipo):
+        with self._lock:
+            self._contadores[chave.split(":", 1)[0]][tipo] += 1
+
+    def _ler(self, chave):
+        if self._usa_redis():
+            try:
+                valor = self._redis.get(_PREFIXO + chave)
+                return None if valor is None else (json.loads(valor),)
+            except redis.RedisError as e:
+                self._falha_redis(e)
+        entrada = self._local.get(chave)
+        return None if entrada is None else (entrada[1],)
+
+    def _escrever(self, chave, valor, ttl):
+        if self._usa_redis():
+            try:
+                self._redis.set(_PREFIXO + chave, codificar(valor), px=int(ttl * 1000))
+                return
+            except redis.RedisError as e:
+                self._falha_redis(e)
+        self._local.set(chave, valor, ttl)
+
+    def obter(self, chave, carregar, ttl=None):
+        """Devolve o valor em cache para ``chave`` ou, se não existir, o
+        resultado de ``carregar()``, que fica guardado durante ``ttl`` segundos.
+        O valor tem de ser serializável em JSON."""
+        encontrado = self._ler(chave)
+        if encontrado is not None:
+            self._contar(chave, "hits")
+            return encontrado[0]
+        self._contar(chave, "misses")
+        valor = carregar()
+        self._escrever(chave, valor, self.ttl if ttl is None else ttl)
+        return valor
+
+    async def obter_async(self, chave, carregar, ttl=None):
+        """``obter`` com um ``carregar`` assíncrono (asgi.py). O acesso ao
+        Redis continua síncrono, limitado pelos timeouts de 0,1 s."""
+        encontrado = self._ler(chave)
+        if encontrado is not None:
+            self._contar(chave, "hits")
+            return encontrado[0]
+        self._contar(chave, "misses")
+        valor = await carregar()
+        self._escrever(chave, valor, self.ttl if ttl is None else ttl)
+        return valor
+
+    def partilhar(self, chave, carregar, janela=COALESCER_JANELA, espera=COALESCER_ESPERA):
+        """``carregar()`` para ``chave``, uma só vez para todos os pedidos que a
+        pedem ao mesmo tempo; o resultado fica ``janela`` segundos em cache.
+        Uma falha de ``carregar()`` chega também a quem esperava por ele.
+        Como em ``obter``, o valor tem de ser serializável (serializacao.py)
+        e ``chave`` deve incluir a versão dos dados de que depende."""
+        encontrado = self._ler(chave)
+        if encontrado is not None:
+            self._contar(chave, "hits")
+            return encontrado[0]
+        with self._lock:
+            voo = self._voos.get(chave)
+            lider = voo is None
+            if lider:
+                voo = self._voos[chave] = _Voo()
+        if not lider:
+            self._contar(chave, "partilhados")
+            if voo.acabou.wait(espera):
+                if voo.erro is not None:
+                    raise voo.erro
+                return voo.valor
+            self._contar(chave, "misses")
+            return carregar()
+        try:
+            voo.valor = self._partilhar_workers(chave, carregar, janela, espera)
+            return voo.valor
+        except Exception as e:
+            voo.erro = e
+            raise
+        finally:
+            with self._lock:
+                del self._voos[chave]
+            voo.acabou.set()
+
+    def _partilhar_workers(self, chave, carregar, janela, espera):
+        """A parte de ``partilhar`` entre workers: sem Redis, ``carregar()``;
+        com Redis, só o worker que fica com o lock da chave corre a query, e
+        os outros esperam que o resultado apareça na cache."""
+        token = lock = None
+        if self._usa_redis():
+            lock, token = _PREFIXO_VOO + chave, uuid.uuid4().hex
+            try:
+                if not self._redis.set(lock, token, nx=True, px=int(espera * 1000)):
+                    token = None
+                    fim = time.monotonic() + espera
+                    while True:
+                        # O lock só desaparece depois de o resultado estar na cache.
+                        em_curso = self._redis.exists(lock)
+                        encontrado = self._ler(chave)
+                        if encontrado is not None:
+                            self._contar(chave, "partilhados")
+                            return encontrado[0]
+                        if not em_curso or time.monotonic() >= fim:
+                            break
+                        time.sleep(_VOO_PAUSA)
+            except redis.RedisError as e:
+                self._falha_redis(e)
+                token = None
+        self._contar(chave, "misses")
+        try:
+            valor = carregar()
+            if token is not None:
+                # Os outros workers leem o resultado da cache, mesmo sem janela.
+                janela = max(janela, _VOO_PAUSA * 10)
+            if janela > 0:
+                self._escrever(chave, valor, janela)
+            return valor
+        finally:
+            if token is not None:
+                try:
+                    self._redis.eval(_LIBERTAR_VOO, 1, lock, token)
+                except redis.RedisError as e:
+                    self._falha_redis(e)
+
+    def invalidar(self, *chaves):
+        """Remove as chaves indicadas; uma chave terminada em ``*`` remove
+        todas as que começam pelo prefixo."""
+        for chave in chaves:
+            if chave.endswith("*"):
+                self._local.delete_prefixo(chave[:-1])
+            else:
+                self._local.delete(chave)
+            if self._redis is not None:
+                try:
+                    if chave.endswith("*"):
+                        nomes = list(self._redis.scan_iter(match=_PREFIXO + chave))
+                        if nomes:
+                            self._redis.delete(*nomes)
+                    else:
+                        self._redis.delete(_PREFIXO + chave)
+                except redis.RedisError as e:
+                    self._falha_redis(e)
+
+    def versoes(self, chaves):
+        """``(origem, [(versao, instante), ...])`` das chaves, numa só ida ao
+        Redis. A origem diz onde vivem as versões (a época das versões no
+        Redis, ou o identificador deste processo para as locais): duas
+        versões só são comparáveis com a mesma origem. A época muda se o
+        Redis perder as versões (reinício sem persistência, FLUSHALL), em
+        que os contadores recomeçam do zero. O instante é o da última alteração,
+        ou 0 para uma chave que nunca mudou: sem Redis, cada processo tem os
+        seus, e um instante da primeira leitura seria diferente em cada
+        worker."""
+        if self._usa_redis():
+            try:
+                nomes = [_PREFIXO_VERSAO + c for c in chaves]
+                valores = self._redis.mget([_EPOCA] + nomes + [n + ":t" for n in nomes])
+                epoca, valores = valores[0], valores[1:]
+                contadores, instantes = valores[:len(chaves)], valores[len(chaves):]
+                if epoca is None:
+                    self._redis.set(_EPOCA, uuid.uuid4().hex, nx=True)
+                    epoca = self._redis.get(_EPOCA)
+                origem = "redis:" + epoca.decode()
+                return origem, [(int(v or 0), float(t or 0)) for v, t in zip(contadores, instantes)]
+            except redis.RedisError as e:
+                self._falha_redis(e)
+        with self._lock:
+            return self._origem, [self._versoes.get(c, (0, 0.0)) for c in chaves]
+
+    def incrementar_versoes(self, *chaves):
+        agora = time.time()
+        with self._lock:
+            for chave in chaves:
+                self._versoes[chave] = (self._versoes.get(chave, (0, 0.0))[0] + 1, agora)
+        if self._redis is not None:
+            try:
+                with self._redis.pipeline(transaction=False) as p:
+                    for chave in chaves:
+                        p.incr(_PREFIXO_VERSAO + chave)
+                        p.set(_PREFIXO_VERSAO + chave + ":t", agora)
+                    p.execute()
+            except redis.RedisError as e:
+                self._falha_redis(e)
+
+    def estatisticas(self):
+        with self._lock:
+            familias = {f: dict(c) for f, c in self._contadores.items()}
+        for c in familias.values():
+            total = c["hits"] + c["misses"]
+            c["hit_ratio"] = round(c["hits"] / total, 4) if total else None
+        return {
+            "backend": "redis" if self._usa_redis() else "lru",
+            "familias": familias,
+        }
+
+
+cache = Cache()
+os.register_at_fork(after_in_child=cache.renovar_origem)
+
+
+# Ganchos de invalidação: chamar sempre que clinica, medico ou trabalha mudam,
+# e invalidar_vagas sempre que se marcam ou cancelam consultas. Com a
+# migration 0008, os workers chamam-nos também a partir dos avisos do
+# Postgres (notificacoes.py).
+
+def invalidar_clinicas():
+    cache.invalidar("clinicas")
+    cache.incrementar_versoes("clinicas")
+
+
+def invalidar_especialidades(clinica=None):
+    """Sem ``clinica``, invalida as especialidades (e as vagas) de todas as
+    clínicas: as rotas juntam a versão global ``especialidades`` à de cada
+    clínica."""
+    if clinica is None:
+        cache.invalidar("especialidades:*")
+        cache.incrementar_versoes("especialidades")
+    else:
+        cache.invalidar(f"especialidades:{clinica}")
+        cache.incrementar_versoes(f"especialidades:{clinica}")
+
+
+def invalidar_vagas(afetadas=None):
+    """Muda a versão das vagas de cada par ``(clinica, especialidade)`` em
+    ``afetadas``; sem argumentos, a de todas (depois de ``refrescar-vagas``)."""
+    if afetadas is None:
+        cache.incrementar_versoes("vagas")
+    elif afetadas:
+        cache.incrementar_versoes(*{f"vagas:{clinica}:{especialidade}" for clinica, especialidade in afetadas})
@@ -0,0 +1,124 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Geração de códigos SNS únicos sem consultar a base de dados.
+
+Cada código é a imagem de um contador por uma permutação com chave do
+intervalo [0, 10^12): contadores diferentes dão sempre códigos diferentes,
+mas a sequência de códigos parece aleatória. A permutação é uma rede de
+Feistel sobre as duas metades de 6 dígitos do número.
+
+A API e os geradores de dados (levedura.py, info.py) têm de usar a mesma
+chave para que os códigos de uns e de outros nunca colidam.
+"""
+import hashlib
+import os
+import threading
+from collections import deque
+
+from preparadas import executar, executar_async, preparada
+
+CODIGO_SNS_CHAVE = os.environ.get("CODIGO_SNS_CHAVE", "saude").encode()
+
+DIGITOS = 12
+_METADE = 10 ** (DIGITOS // 2)
+_RONDAS = 4
+
+
+def _ronda(chave, ronda, valor):
+    h = hashlib.blake2b(f"{ronda}:{valor}".encode(), key=chave, digest_size=8)
+    return int.from_bytes(h.digest(), "big") % _METADE
+
+
+def permutar(n, chave=CODIGO_SNS_CHAVE):
+    """Bijeção de [0, 10^12) em si mesmo, determinada pela chave."""
+    esquerda, direita = divmod(n, _METADE)
+    for ronda in range(_RONDAS):
+        esquerda, direita = direita, (esquerda + _ronda(chave, ronda, direita)) % _METADE
+    return esquerda * _METADE + direita
+
+
+def codigo_sns(n, chave=CODIGO_SNS_CHAVE):
+    """Código SNS de 12 dígitos correspondente ao contador ``n``."""
+    return f"{permutar(n, chave):0{DIGITOS}d}"
+
+
+RESERVAR_BLOCOS = preparada("reservar_blocos", '''
+    SELECT nextval('codigo_sns_seq') AS inicio, s.increment_by AS tamanho
+    FROM pg_sequences s, generate_series(1, %(blocos)s::int)
+    WHERE s.schemaname = current_schema() AND s.sequencename = 'codigo_sns_seq';
+''')
+
+
+def reservar_blocos(cur, blocos=1):
+    """Reserva na sequência codigo_sns_seq ``blocos`` blocos de contadores só
+    para este processo (migrations/0002_codigo_sns_seq.sql), numa única query.
+    Devolve uma lista de ``(inicio, fim)``."""
+    linhas = executar(cur, RESERVAR_BLOCOS, {"blocos": blocos}).fetchall()
+    return [(r.inicio, r.inicio + r.tamanho) for r in linhas]
+
+
+async def reservar_blocos_async(acur, blocos=1):
+    """``reservar_blocos`` para um cursor assíncrono (asgi.py)."""
+    await executar_async(acur, RESERVAR_BLOCOS, {"blocos": blocos})
+    return [(r.inicio, r.inicio + r.tamanho) for r in await acur.fetchall()]
+
+
+class GeradorCodigoSNS:
+    """Distribui códigos SNS a partir de blocos de contadores.
+
+    ``reservar(blocos)`` é chamado sempre que os blocos em mão se esgotam e
+    devolve uma lista de novos ``(inicio, fim)``; sem ``reservar`` o contador é
+    local e começa em ``inicio``, o que chega para os geradores de dados.
+    """
+
+    def __init__(self, reservar=None, inicio=1, chave=CODIGO_SNS_CHAVE, tamanho_bloco=100):
+        self._reservar = reservar
+        self._chave = chave
+        self._tamanho_bloco = tamanho_bloco
+        self._blocos = deque()
+        if reservar is None:
+            self._blocos.append((inicio, None))
+        self._lock = threading.Lock()
+
+    def _contadores(self, quantidade):
+        contadores = []
+        while len(contadores) < quantidade:
+            if not self._blocos:
+                em_falta = quantidade - len(contadores)
+                novos = self._reservar(-(-em_falta // self._tamanho_bloco))
+                self._tamanho_bloco = novos[0][1] - novos[0][0]
+                self._blocos.extend(novos)
+            inicio, fim = self._blocos.popleft()
+            ate = inicio + quantidade - len(contadores)
+            if fim is not None:
+                ate = min(ate, fim)
+            contadores.extend(range(inicio, ate))
+            if fim is None or ate < fim:
+                self._blocos.appendleft((ate, fim))
+        return contadores
+
+    def blocos_em_falta(self, quantidade):
+        """Quantos blocos novos é preciso reservar para dar ``quantidade``
+        códigos sem chamar ``reservar``; permite reservá-los fora do gerador,
+        por exemplo numa ligação assíncrona, e entregá-los a ``acrescentar``."""
+        if any(fim is None for _, fim in self._blocos):
+            return 0
+        em_falta = quantidade - sum(fim - inicio for inicio, fim in self._blocos)
+        return max(0, -(-em_falta // self._tamanho_bloco))
+
+    def acrescentar(self, blocos):
+        """Junta blocos ``(inicio, fim)`` já reservados aos que estão em mão."""
+        with self._lock:
+            self._tamanho_bloco = blocos[0][1] - blocos[0][0]
+            self._blocos.extend(blocos)
+
+    def proximo(self):
+        with self._lock:
+            (n,) = self._contadores(1)
+        return codigo_sns(n, self._chave)
+
+    def proximos(self, quantidade):
+        """``quantidade`` códigos de uma vez, com no máximo uma reserva."""
+        with self._lock:
+            contadores = self._contadores(quantidade)
+        return [codigo_sns(n, self._chave) for n in contadores]
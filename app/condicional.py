@@ -0,0 +1,77 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Pedidos GET condicionais (ETag e Last-Modified) para as rotas de leitura.
+
+O ETag de uma resposta é calculado só a partir das versões dos recursos de
+que ela depende (ver ``Cache.versoes``) e da origem dessas versões, sem ir
+à base de dados. Os instantes das alterações ficam de fora do ETag: sem
+Redis, cada worker regista a mesma alteração num instante seu. A origem
+entra: sem Redis, as versões são de cada processo e só o próprio worker pode
+dizer que um ETag seu continua atual. Quando o cliente manda ``If-None-Match`` com esse ETag, ou ``If-Modified-Since`` sem
+alterações desde então, a resposta é um 304 e a rota nem chega a correr.
+
+As vagas mudam também com a passagem do tempo (os horários vão ficando no
+passado), por isso as rotas de disponibilidade juntam às versões o intervalo
+de ``intervalo`` segundos em que o pedido cai.
+
+Uma resposta gerada a partir de uma réplica de leitura atrasada teria o ETag
+da versão nova com os dados antigos. Por isso, se algum dos recursos mudou
+há menos do que o atraso tolerado à réplica, o pedido lê do primário.
+"""
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from flask import current_app, g, request
+
+import db
+from cache import cache
+
+
+def etag(chaves, intervalo=None):
+    """ETag e instante da última alteração de uma resposta que depende das
+    versões ``chaves`` e, com ``intervalo``, da janela de tempo atual (None
+    se nenhuma mudou); e o instante (em segundos, 0 se nenhuma mudou) em que
+    a mais recente dessas versões mudou."""
+    origem, versoes = cache.versoes(chaves)
+    partes = [f"origem={origem}"] + [f"{c}={v}" for c, (v, _) in zip(chaves, versoes)]
+    alterado = modificado = max(t for _, t in versoes)
+    if intervalo:
+        janela = int(time.time() // intervalo)
+        partes.append(f"janela={janela}")
+        modificado = max(modificado, janela * intervalo)
+    valor = hashlib.blake2b("\n".join(partes).encode(), digest_size=12).hexdigest()
+    if not modificado:
+        return valor, None, alterado
+    return valor, datetime.fromtimestamp(int(modificado), timezone.utc), alterado
+
+
+def condicional(chaves, gerar, intervalo=None):
+    """Responde 304 se a versão que o cliente tem ainda é a atual; caso
+    contrário devolve ``gerar()`` com ``ETag`` e ``Last-Modified``. Só as
+    respostas 200 levam validadores. ``gerar`` encontra o ETag em ``g.etag``,
+    para chavear pela versão o que guardar em cache."""
+    valor, modificado, alterado = etag(chaves, intervalo)
+    g.etag = valor
+
+    if request.if_none_match:
+        inalterado = request.if_none_match.contains_weak(valor)
+    else:
+        inalterado = (
+            request.if_modified_since is not None and modificado is not None
+            and modificado <= request.if_modified_since
+        )
+    if inalterado:
+        resposta = current_app.response_class(status=304)
+    else:
+        if time.time() - alterado < db.DATABASE_READ_MAX_ATRASO:
+            db.ler_do_primario()
+        resposta = current_app.make_response(gerar())
+        if resposta.status_code != 200:
+            return resposta
+
+    resposta.set_etag(valor, weak=True)
+    resposta.last_modified = modificado
+    # O cliente pode guardar a resposta, mas tem de a revalidar sempre.
+    resposta.cache_control.no_cache = True
+    return resposta
@@ -0,0 +1,166 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Instruções SQL das rotas da API.
+
+Ficam aqui e não dentro das rotas porque são partilhadas pela versão WSGI
+(app.py) e pela versão ASGI (asgi.py), que têm de responder exatamente o
+mesmo, e estão todas no registo de queries preparadas (preparadas.py).
+"""
+from preparadas import preparada
+
+
+def _afetadas(nif):
+    """Pares ``[clinica, especialidade]`` cujas vagas mudam quando muda a
+    agenda do médico ``nif``: as de todas as clínicas onde ele trabalha
+    (ver ``cache.invalidar_vagas``)."""
+    return f'''ARRAY(
+        SELECT DISTINCT ARRAY[tr.nome, m.especialidade]
+        FROM medico m
+        JOIN trabalha tr ON tr.nif = m.nif
+        WHERE m.nif = {nif}
+    ) AS afetadas'''
+
+LISTAR_CLINICAS = preparada("listar_clinicas", '''
+    SELECT nome, morada
+    FROM clinica;
+''')
+
+LISTAR_ESPECIALIDADES = preparada("listar_especialidades", '''
+    SELECT DISTINCT m.especialidade
+    FROM  medico m
+    JOIN
+        trabalha t ON m.nif = t.nif
+    JOIN
+        clinica c ON t.nome = c.nome
+    WHERE c.nome = %(clinica)s;
+''')
+
+# O id vem da sequência consulta_id_seq (migrations/0001_consulta_id_seq.sql)
+# e o horário sai do índice de vagas do médico no mesmo statement. Se outro
+# pedido marcou entretanto o mesmo horário do médico ou do paciente, os
+# índices únicos de migrations/0007_consulta_horario_unico.sql fazem o INSERT
+# não inserir nada e a query não devolve nenhuma linha, sem erro. O ON
+# CONFLICT não tem alvo (o médico e o paciente são dois índices) e apanha
+# também os conflitos de id ou codigo_sns: antes de responder 409, as rotas
+# confirmam com ``confirma_tomados`` (validacao.py) que o horário está mesmo
+# ocupado.
+MARCAR = preparada("marcar", f'''
+    WITH nova AS (
+        INSERT INTO consulta (ssn, nif, nome, data, hora, codigo_sns)
+        VALUES (%(ssn)s, %(nif)s, %(clinica_nome)s, %(data)s, %(hora)s, %(codigo_sns)s)
+        ON CONFLICT DO NOTHING
+        RETURNING id, nif, data, hora
+    ), ocupada AS (
+        DELETE FROM vaga v
+        USING nova n
+        WHERE v.nif = n.nif AND v.data = n.data AND v.hora = n.hora
+    )
+    SELECT id, {_afetadas("nova.nif")} FROM nova;
+''')
+
+# Apaga a consulta e devolve o horário ao índice de vagas das clínicas onde
+# o médico trabalha nesse dia da semana.
+CANCELAR = preparada("cancelar", f'''
+    WITH apagada AS (
+        DELETE
+        FROM consulta
+        WHERE
+            nome = %(clinica)s AND
+            ssn = %(ssn)s AND
+            nif = %(nif)s AND
+            data = %(data)s AND
+            hora = %(hora)s
+        RETURNING nif, data, hora
+    ), libertada AS (
+        INSERT INTO vaga (nome, nif, data, hora)
+        SELECT tr.nome, a.nif, a.data, a.hora
+        FROM apagada a
+        JOIN trabalha tr ON tr.nif = a.nif AND tr.dia_da_semana = EXTRACT(DOW FROM a.data)
+        WHERE
+            a.hora = ANY(%(grelha)s::time[]) AND
+            a.data <= CURRENT_DATE + %(horizonte)s::int
+        ON CONFLICT DO NOTHING
+    )
+    SELECT count(*) AS apagadas, {_afetadas("%(nif)s")} FROM apagada;
+''')
+
+# Um só INSERT para um lote inteiro de marcações: os ids saem da sequência
+# consulta_id_seq e os horários saem do índice de vagas. As marcações cujo
+# horário outro pedido ocupou entretanto ficam de fora, como em MARCAR, e
+# também se confirmam com ``confirma_tomados``.
+MARCAR_LOTE = preparada("marcar_lote", f'''
+    WITH novas AS (
+        INSERT INTO consulta (ssn, nif, nome, data, hora, codigo_sns)
+        SELECT l.ssn, l.nif, %(clinica)s, l.data, l.hora, l.codigo_sns
+        FROM unnest(
+            %(ssn)s::text[], %(nif)s::text[], %(data)s::date[],
+            %(hora)s::time[], %(codigo_sns)s::text[]
+        ) AS l(ssn, nif, data, hora, codigo_sns)
+        ON CONFLICT DO NOTHING
+        RETURNING id, nif, data, hora, codigo_sns
+    ), ocupadas AS (
+        DELETE FROM vaga v
+        USING novas n
+        WHERE v.nif = n.nif AND v.data = n.data AND v.hora = n.hora
+    )
+    SELECT id, codigo_sns, {_afetadas("novas.nif")} FROM novas;
+''')
+
+# Cancelamento em lote: um único DELETE ... RETURNING sobre as consultas
+# escolhidas, só das que ainda não se realizaram, que devolve os horários
+# libertados ao índice de vagas no mesmo statement.
+_CANCELAR_LOTE = f'''
+    WITH apagadas AS (
+        DELETE FROM consulta c
+        {{origem}}
+        WHERE
+            c.nome = %(clinica)s AND
+            {{filtro}} AND
+            c.data + c.hora > LOCALTIMESTAMP
+        RETURNING c.id, c.ssn, c.nif, c.data, c.hora, c.codigo_sns
+    ), libertadas AS (
+        INSERT INTO vaga (nome, nif, data, hora)
+        SELECT tr.nome, a.nif, a.data, a.hora
+        FROM apagadas a
+        JOIN trabalha tr ON tr.nif = a.nif AND tr.dia_da_semana = EXTRACT(DOW FROM a.data)
+        WHERE
+            a.hora = ANY(%(grelha)s::time[]) AND
+            a.data <= CURRENT_DATE + %(horizonte)s::int
+        ON CONFLICT DO NOTHING
+    )
+    SELECT id, ssn, nif, data, hora, codigo_sns, {_afetadas("apagadas.nif")}
+    FROM apagadas
+    ORDER BY data, hora, nif;
+'''
+
+CANCELAR_LOTE_LISTA = preparada("cancelar_lote_lista", _CANCELAR_LOTE.format(
+    origem="USING unnest(%(ssn)s::text[], %(nif)s::text[], %(data)s::date[], %(hora)s::time[]) AS l(ssn, nif, data, hora)",
+    filtro="c.ssn = l.ssn AND c.nif = l.nif AND c.data = l.data AND c.hora = l.hora",
+))
+
+CANCELAR_LOTE_INTERVALO = preparada("cancelar_lote_intervalo", _CANCELAR_LOTE.format(
+    origem="",
+    filtro="c.nif = %(nif)s AND c.data BETWEEN %(de)s AND %(ate)s",
+))
+
+# Consultas da <clinica> entre <de> e <ate>, pela ordem (data, hora, id) e a
+# seguir à chave da página anterior. A comparação de linhas inclui o nome da
+# clínica para o Postgres a usar como condição de índice em
+# consulta_nome_data_hora_id_idx (migrations/0004_consulta_nome_data_hora_id_idx.sql);
+# com limite NULL devolve todas as linhas, para a exportação.
+LISTAR_CONSULTAS = preparada("listar_consultas", '''
+    SELECT id, ssn, nif, data, hora, codigo_sns
+    FROM consulta
+    WHERE
+        nome = %(clinica)s AND
+        (nome, data, hora, id) > (
+            %(clinica)s,
+            COALESCE(%(data)s::date, '-infinity'),
+            COALESCE(%(hora)s::time, '00:00'),
+            COALESCE(%(id)s::bigint, 0)
+        ) AND
+        data >= COALESCE(%(de)s::date, '-infinity') AND
+        data <= COALESCE(%(ate)s::date, 'infinity')
+    ORDER BY data, hora, id
+    LIMIT %(limite)s;
+''')
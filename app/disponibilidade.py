@@ -0,0 +1,312 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Horários livres por médico e por clínica.
+
+Os horários candidatos saem de ``trabalha`` (clínica e dia da semana em que
+cada médico dá consultas) cruzado com a grelha de meias horas das consultas,
+dentro de um horizonte de dias configurável; os horários já marcados são
+retirados com um anti-join sobre ``consulta``. O custo cresce com o número de
+horários percorridos e não com o histórico de consultas do médico.
+
+Há três modos, escolhidos por ``DISPONIBILIDADE_MODO``:
+
+* ``indice`` (por omissão): lê a tabela ``vaga`` (migrations/0003_vaga.sql),
+  que as marcações e os cancelamentos mantêm incrementalmente e que
+  ``refrescar_vagas`` reconstrói (``flask refrescar-vagas``). Os dias que vão
+  entrando no horizonte são acrescentados pela própria app, uma vez por dia
+  (``estender_vagas``); enquanto a tabela não chega ao fim do horizonte
+  (migrations/0009_vaga_horizonte.sql), as vagas calculam-se como em
+  ``direto``;
+* ``direto``: calcula os horários a cada pedido, sem tabela auxiliar;
+* ``agenda``: traz numa query a máscara de ocupação de cada médico por dia
+  (ver agenda.py) e procura os horários livres em memória.
+"""
+import logging
+import os
+import threading
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+import psycopg
+
+import db
+from agenda import GRELHA, Agenda
+from cache import invalidar_vagas
+from preparadas import executar, executar_async, preparada
+
+log = logging.getLogger(__name__)
+
+DISPONIBILIDADE_MODO = os.environ.get("DISPONIBILIDADE_MODO", "indice")
+DISPONIBILIDADE_HORIZONTE_DIAS = int(os.environ.get("DISPONIBILIDADE_HORIZONTE_DIAS", 30))
+
+Vaga = namedtuple("Vaga", "nif medico data hora")
+
+# Horários candidatos de um médico (tr.nif) numa clínica (tr.nome), a partir
+# de hoje e até ao fim do horizonte, que não colidem com consultas dele.
+_CANDIDATOS = '''
+    SELECT tr.nome, tr.nif, d.data, h.hora
+    FROM (
+        SELECT CURRENT_DATE + n AS data
+        FROM generate_series(0, %(horizonte)s::int) AS n
+    ) d
+    JOIN trabalha tr ON tr.dia_da_semana = EXTRACT(DOW FROM d.data)
+    CROSS JOIN unnest(%(grelha)s::time[]) AS h(hora)
+    WHERE
+        -- Em timestamp: time + interval dá a volta à meia-noite, e depois das
+        -- 23:00 todos os horários de hoje passariam.
+        d.data + h.hora > LOCALTIMESTAMP + INTERVAL '1 hour' AND
+        NOT EXISTS (
+            SELECT 1
+            FROM consulta c
+            WHERE c.nif = tr.nif AND c.data = d.data AND c.hora = h.hora
+        )
+'''
+
+# Primeiros horários livres de cada médico da <especialidade> na <clinica>,
+# lidos do índice: um index scan curto na chave de vaga por médico.
+PRIMEIRAS_VAGAS = preparada("primeiras_vagas", '''
+    SELECT m.nif, m.nome AS medico, v.data, v.hora
+    FROM medico m
+    CROSS JOIN LATERAL (
+        SELECT data, hora
+        FROM vaga
+        WHERE
+            nome = %(clinica)s AND
+            nif = m.nif AND
+            data >= CURRENT_DATE AND
+            data + hora > LOCALTIMESTAMP + INTERVAL '1 hour'
+        ORDER BY data, hora
+        LIMIT %(limite)s
+    ) v
+    WHERE m.especialidade = %(especialidade)s
+    ORDER BY m.nif, v.data, v.hora;
+''')
+
+# O mesmo, calculado na hora a partir de trabalha e da grelha.
+PRIMEIRAS_VAGAS_DIRETO = preparada("primeiras_vagas_direto", f'''
+    SELECT m.nif, m.nome AS medico, v.data, v.hora
+    FROM medico m
+    CROSS JOIN LATERAL (
+        SELECT candidato.data, candidato.hora
+        FROM ({_CANDIDATOS}) AS candidato
+        WHERE candidato.nome = %(clinica)s AND candidato.nif = m.nif
+        ORDER BY candidato.data, candidato.hora
+        LIMIT %(limite)s
+    ) v
+    WHERE m.especialidade = %(especialidade)s
+    ORDER BY m.nif, v.data, v.hora;
+''')
+
+# Médicos da <especialidade> que trabalham na <clinica>, os dias da semana
+# em que lá trabalham e a máscara de ocupação de cada dia do horizonte.
+MEDICOS_E_MASCARAS = preparada("medicos_e_mascaras", '''
+    SELECT m.nif, m.nome AS medico, tr.dias, o.data, o.mascara
+    FROM medico m
+    CROSS JOIN LATERAL (
+        SELECT array_agg(dia_da_semana) AS dias
+        FROM trabalha
+        WHERE nif = m.nif AND nome = %(clinica)s
+    ) tr
+    LEFT JOIN LATERAL (
+        SELECT
+            c.data,
+            bit_or(1 << (array_position(%(grelha)s::time[], c.hora) - 1)) AS mascara
+        FROM consulta c
+        WHERE
+            c.nif = m.nif AND
+            c.data BETWEEN CURRENT_DATE AND CURRENT_DATE + %(horizonte)s::int AND
+            c.hora = ANY(%(grelha)s::time[])
+        GROUP BY c.data
+    ) o ON TRUE
+    WHERE m.especialidade = %(especialidade)s AND tr.dias IS NOT NULL
+    ORDER BY m.nif;
+''')
+
+
+def _vagas_da_agenda(linhas, horizonte, limite):
+    hoje = date.today()
+    agenda = Agenda(hoje, horizonte + 1)
+    medicos = {}
+    for r in linhas:
+        medicos.setdefault(r.nif, (r.medico, set(r.dias)))
+        if r.data is not None:
+            agenda.ocupar_mascara(r.nif, r.data, r.mascara)
+
+    depois_de = datetime.now() + timedelta(hours=1)
+    return [
+        Vaga(nif, medico, data, hora)
+        for nif, (medico, dias) in medicos.items()
+        for data, hora in agenda.primeiros_livres(nif, hoje, limite, dias, depois_de)
+    ]
+
+
+def primeiras_vagas_agenda(cur, clinica, especialidade, horizonte, limite=3):
+    """Primeiros horários livres de cada médico, calculados na agenda em
+    memória a partir de uma única query de máscaras."""
+    linhas = executar(
+        cur,
+        MEDICOS_E_MASCARAS,
+        {"clinica": clinica, "especialidade": especialidade, "horizonte": horizonte, "grelha": list(GRELHA)},
+    ).fetchall()
+    return _vagas_da_agenda(linhas, horizonte, limite)
+
+
+REFRESCAR_VAGAS = preparada("refrescar_vagas", f'''
+    INSERT INTO vaga (nome, nif, data, hora)
+    {_CANDIDATOS};
+''')
+
+# Se a tabela vaga chega ao fim do horizonte de hoje.
+VAGAS_ATUAIS = preparada("vagas_atuais", '''
+    SELECT COALESCE(bool_and(ate >= CURRENT_DATE + %(horizonte)s::int), FALSE) AS atuais
+    FROM vaga_horizonte;
+''')
+
+# Os dias do horizonte depois do último que a tabela cobre; os dias que já
+# passaram saem.
+ESTENDER_VAGAS = preparada("estender_vagas", f'''
+    WITH passadas AS (
+        DELETE FROM vaga WHERE data < CURRENT_DATE
+    ), horizonte AS (
+        UPDATE vaga_horizonte
+        SET ate = CURRENT_DATE + %(horizonte)s::int
+        WHERE ate < CURRENT_DATE + %(horizonte)s::int
+        RETURNING 1
+    )
+    INSERT INTO vaga (nome, nif, data, hora)
+    SELECT candidato.*
+    FROM ({_CANDIDATOS}) AS candidato
+    WHERE candidato.data > (SELECT ate FROM vaga_horizonte)
+    ON CONFLICT DO NOTHING;
+''')
+
+GUARDAR_HORIZONTE = preparada("guardar_horizonte", '''
+    UPDATE vaga_horizonte SET ate = CURRENT_DATE + %(horizonte)s::int;
+''')
+
+# Chave do advisory lock de quem estende ou reconstrói a tabela vaga.
+_LOCK_VAGAS = 0x76616761
+
+
+def parametros(**extra):
+    """Parâmetros comuns a todas as queries de disponibilidade."""
+    return {"horizonte": DISPONIBILIDADE_HORIZONTE_DIAS, "grelha": list(GRELHA), **extra}
+
+
+class Indice:
+    """Se a tabela vaga está atualizada, e a extensão diária dela, uma vez
+    por dia em cada processo."""
+
+    def __init__(self):
+        # Dia em que a tabela foi vista atualizada, e em que foi estendida.
+        self.atual_em = None
+        self.estendido_em = None
+        self._lock = threading.Lock()
+
+    def atual(self, linha):
+        """Regista a resposta a VAGAS_ATUAIS; uma tabela atualizada fica
+        assim até ao fim do dia, sem voltar a perguntar."""
+        if linha.atuais:
+            self.atual_em = date.today()
+        return linha.atuais
+
+    def estender(self):
+        """Arranca a extensão da tabela numa thread, se ainda não foi feita
+        hoje neste processo."""
+        hoje = date.today()
+        if self.estendido_em == hoje:
+            return
+        with self._lock:
+            if self.estendido_em == hoje:
+                return
+            self.estendido_em = hoje
+        threading.Thread(target=self._estender, name="estender-vagas", daemon=True).start()
+
+    def _estender(self):
+        try:
+            with db.ligacao() as conn:
+                inseridas = estender_vagas(conn)
+        except psycopg.Error as e:
+            log.warning(f"Não foi possível estender as vagas: {e}")
+            self.estendido_em = None
+            return
+        if inseridas:
+            log.info(f"{inseridas} vagas novas no horizonte.")
+            invalidar_vagas()
+
+
+indice = Indice()
+
+
+def _indice_atual(cur):
+    if indice.atual_em == date.today():
+        return True
+    return indice.atual(executar(cur, VAGAS_ATUAIS, parametros()).fetchone())
+
+
+def primeiras_vagas(cur, clinica, especialidade, limite=3, modo=None):
+    modo = modo or DISPONIBILIDADE_MODO
+    if modo == "agenda":
+        return primeiras_vagas_agenda(cur, clinica, especialidade, DISPONIBILIDADE_HORIZONTE_DIAS, limite)
+    if modo == "direto" or (modo == "indice" and not _indice_atual(cur)):
+        query = PRIMEIRAS_VAGAS_DIRETO
+    else:
+        query = PRIMEIRAS_VAGAS
+    return executar(
+        cur,
+        query,
+        parametros(clinica=clinica, especialidade=especialidade, limite=limite),
+    ).fetchall()
+
+
+async def primeiras_vagas_async(acur, clinica, especialidade, limite=3, modo=None):
+    """``primeiras_vagas`` para um cursor assíncrono (asgi.py)."""
+    modo = modo or DISPONIBILIDADE_MODO
+    if modo == "agenda":
+        await executar_async(
+            acur,
+            MEDICOS_E_MASCARAS,
+            parametros(clinica=clinica, especialidade=especialidade),
+        )
+        return _vagas_da_agenda(await acur.fetchall(), DISPONIBILIDADE_HORIZONTE_DIAS, limite)
+    atuais = modo != "direto"
+    if modo == "indice" and indice.atual_em != date.today():
+        await executar_async(acur, VAGAS_ATUAIS, parametros())
+        atuais = indice.atual(await acur.fetchone())
+    query = PRIMEIRAS_VAGAS if atuais else PRIMEIRAS_VAGAS_DIRETO
+    await executar_async(acur, query, parametros(clinica=clinica, especialidade=especialidade, limite=limite))
+    return await acur.fetchall()
+
+
+def refrescar_vagas(conn):
+    """Reconstrói a tabela vaga numa só transação; quem lê continua a ver a
+    versão anterior até ao commit."""
+    with conn.transaction():
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (_LOCK_VAGAS,))
+            cur.execute("DELETE FROM vaga;")
+            executar(cur, REFRESCAR_VAGAS, parametros())
+            refrescadas = cur.rowcount
+            executar(cur, GUARDAR_HORIZONTE, parametros())
+            return refrescadas
+
+
+def estender_vagas(conn):
+    """Acrescenta à tabela vaga os dias que entraram no horizonte desde a
+    última extensão e tira os que já passaram, numa só transação. Devolve
+    as vagas inseridas, ou None se outro processo já está a estender ou a
+    reconstruir a tabela."""
+    with conn.transaction():
+        with conn.cursor() as cur:
+            if not cur.execute("SELECT pg_try_advisory_xact_lock(%s);", (_LOCK_VAGAS,)).fetchone()[0]:
+                return None
+            executar(cur, ESTENDER_VAGAS, parametros())
+            return cur.rowcount
+
+
+def init_app(app):
+    if DISPONIBILIDADE_MODO != "indice":
+        return
+    # Cada processo tenta estender a tabela no primeiro pedido de cada dia;
+    # o advisory lock deixa só um fazê-lo.
+    app.before_request(indice.estender)
@@ -0,0 +1,241 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Métricas da API em formato de texto do Prometheus, em ``GET /metrics``.
+
+Por rota (o padrão do URL, não o caminho, para não multiplicar as séries)
+regista um histograma da latência de cada pedido, partido em fases:
+
+* ``total``: do início do pedido até à resposta estar pronta;
+* ``admissao``: espera na fila do controlo de admissão (admissao.py);
+* ``pool``: espera por uma ligação do pool (``db.get_db`` ou ``db.get_db_leitura``);
+* ``sql``: execução das queries do registo de queries preparadas;
+* ``serializacao``: conversão das respostas para JSON.
+
+Conta também os pedidos por código de estado, as linhas devolvidas pelas
+queries e os erros de SQL, e no momento da recolha lê o estado do pool e
+os contadores de cada query preparada. Cada processo tem as suas métricas:
+com vários workers, o Prometheus recolhe-as de cada um.
+
+O custo no caminho de um pedido é o de até quatro observações de histograma
+(uma pesquisa binária e um lock); ``bench/metricas.py`` mede-o.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from flask import Response, g, has_request_context, request
+
+import admissao
+import db
+import notificacoes
+import serializacao
+from preparadas import registo
+
+METRICAS_ATIVAS = os.environ.get("METRICAS_ATIVAS", "1") != "0"
+
+LIMITES = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histograma:
+    """Histograma cumulativo por conjunto de etiquetas, como no Prometheus."""
+
+    def __init__(self, limites=LIMITES):
+        self.limites = limites
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, etiquetas, valor):
+        i = bisect_left(self.limites, valor)
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [[0] * (len(self.limites) + 1), 0.0, 0]
+            serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def series(self):
+        with self._lock:
+            return {etiquetas: ([*contagens], soma, n) for etiquetas, (contagens, soma, n) in self._series.items()}
+
+
+class Contador:
+    def __init__(self):
+        self._series = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def incrementar(self, etiquetas, valor=1):
+        with self._lock:
+            self._series[etiquetas] += valor
+
+    def series(self):
+        with self._lock:
+            return dict(self._series)
+
+
+latencia = Histograma()
+pedidos = Contador()
+linhas = Contador()
+erros_sql = Contador()
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas(nomes, valores, extra=""):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}"
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def texto():
+    """Todas as métricas no formato de exposição de texto do Prometheus."""
+    linhas_texto = []
+
+    def metrica(nome, tipo, ajuda):
+        linhas_texto.append(f"# HELP {nome} {ajuda}")
+        linhas_texto.append(f"# TYPE {nome} {tipo}")
+
+    def contador(nome, ajuda, c, nomes):
+        metrica(nome, "counter", ajuda)
+        for etiquetas, valor in sorted(c.series().items()):
+            linhas_texto.append(f"{nome}{_etiquetas(nomes, etiquetas)} {_numero(valor)}")
+
+    metrica("saude_pedido_segundos", "histogram", "Latência dos pedidos por rota e por fase.")
+    for (rota, fase), (contagens, soma, n) in sorted(latencia.series().items()):
+        acumulado = 0
+        for limite, contagem in zip((*latencia.limites, "+Inf"), contagens):
+            acumulado += contagem
+            le = f'le="{limite}"'
+            linhas_texto.append(f"saude_pedido_segundos_bucket{_etiquetas(('rota', 'fase'), (rota, fase), le)} {acumulado}")
+        linhas_texto.append(f"saude_pedido_segundos_sum{_etiquetas(('rota', 'fase'), (rota, fase))} {_numero(soma)}")
+        linhas_texto.append(f"saude_pedido_segundos_count{_etiquetas(('rota', 'fase'), (rota, fase))} {n}")
+
+    contador("saude_pedidos_total", "Pedidos por rota, método e código de estado.", pedidos, ("rota", "metodo", "estado"))
+    contador("saude_linhas_total", "Linhas devolvidas pelas queries, por rota.", linhas, ("rota",))
+    contador("saude_sql_erros_total", "Queries que falharam, por rota e query.", erros_sql, ("rota", "consulta"))
+
+    metrica("saude_sql_execucoes_total", "counter", "Execuções de cada query preparada.")
+    estatisticas = registo.estatisticas()
+    for e in estatisticas:
+        linhas_texto.append(f"saude_sql_execucoes_total{_etiquetas(('consulta',), (e['nome'],))} {e['execucoes']}")
+    metrica("saude_sql_segundos_total", "counter", "Tempo gasto em cada query preparada.")
+    for e in estatisticas:
+        linhas_texto.append(
+            f"saude_sql_segundos_total{_etiquetas(('consulta',), (e['nome'],))} {_numero(e['tempo_total_ms'] / 1000)}"
+        )
+
+    estado = db.pool.get_stats()
+    tamanho, livres = estado.get("pool_size", 0), estado.get("pool_available", 0)
+    metrica("saude_pool_ligacoes", "gauge", "Ligações do pool em uso e livres.")
+    linhas_texto.append(f'saude_pool_ligacoes{{estado="em_uso"}} {tamanho - livres}')
+    linhas_texto.append(f'saude_pool_ligacoes{{estado="livres"}} {livres}')
+    metrica("saude_pool_ligacoes_max", "gauge", "Máximo de ligações do pool.")
+    linhas_texto.append(f"saude_pool_ligacoes_max {estado.get('pool_max', db.pool.max_size)}")
+    metrica("saude_pool_pedidos_em_espera", "gauge", "Pedidos à espera de uma ligação do pool.")
+    linhas_texto.append(f"saude_pool_pedidos_em_espera {estado.get('requests_waiting', 0)}")
+
+    if admissao.ADMISSAO_ATIVA:
+        estatisticas = admissao.porta.estatisticas()
+        metrica("saude_admissao_pedidos", "gauge", "Pedidos em curso e em espera, por classe de rota.")
+        for classe, e in estatisticas.items():
+            for estado in ("em_curso", "em_espera"):
+                linhas_texto.append(f"saude_admissao_pedidos{_etiquetas(('classe', 'estado'), (classe, estado))} {e[estado]}")
+        metrica("saude_admissao_rejeitados_total", "counter", "Pedidos rejeitados com 503, por classe de rota.")
+        for classe, e in estatisticas.items():
+            linhas_texto.append(f"saude_admissao_rejeitados_total{_etiquetas(('classe',), (classe,))} {e['rejeitados']}")
+
+    if notificacoes.NOTIFICACOES_ATIVAS:
+        metrica("saude_notificacoes_ligado", "gauge", "1 se o worker está à escuta dos avisos de cache.")
+        linhas_texto.append(f"saude_notificacoes_ligado {int(notificacoes.ouvinte.ligado)}")
+        metrica("saude_notificacoes_total", "counter", "Avisos de cache recebidos.")
+        linhas_texto.append(f"saude_notificacoes_total {notificacoes.ouvinte.recebidos}")
+
+    if db.pool_leitura is not None:
+        estado = db.pool_leitura.get_stats()
+        tamanho, livres = estado.get("pool_size", 0), estado.get("pool_available", 0)
+        metrica("saude_pool_leitura_ligacoes", "gauge", "Ligações do pool da réplica em uso e livres.")
+        linhas_texto.append(f'saude_pool_leitura_ligacoes{{estado="em_uso"}} {tamanho - livres}')
+        linhas_texto.append(f'saude_pool_leitura_ligacoes{{estado="livres"}} {livres}')
+        atraso = db.replica.atraso
+        if atraso is not None:
+            metrica("saude_replica_atraso_segundos", "gauge", "Último atraso de replicação medido.")
+            linhas_texto.append(f"saude_replica_atraso_segundos {'+Inf' if atraso == float('inf') else _numero(atraso)}")
+        metrica("saude_leituras_total", "counter", "Pedidos de leitura por destino (réplica ou, por recurso, primário).")
+        for destino, n in sorted(db.replica.leituras.items()):
+            linhas_texto.append(f"saude_leituras_total{_etiquetas(('destino',), (destino,))} {n}")
+
+    return "\n".join(linhas_texto) + "\n"
+
+
+def _rota():
+    return request.url_rule.rule if request.url_rule is not None else "sem_rota"
+
+
+def _observar_sql(preparada, segundos, erro, cur):
+    if not has_request_context() or "metricas_inicio" not in g:
+        return
+    g.metricas_sql += segundos
+    if erro:
+        erros_sql.incrementar((_rota(), preparada.nome))
+    elif cur.rowcount > 0:
+        g.metricas_linhas += cur.rowcount
+
+
+class ProvedorJSON(serializacao.ProvedorJSON):
+    """O provedor JSON da API (serializacao.py), a medir o tempo de serialização."""
+
+    def _codificar(self, obj, legivel=False):
+        inicio = time.perf_counter()
+        try:
+            return super()._codificar(obj, legivel)
+        finally:
+            if has_request_context() and "metricas_inicio" in g:
+                g.metricas_serializacao += time.perf_counter() - inicio
+
+
+def _inicio_pedido():
+    g.metricas_sql = g.metricas_serializacao = 0.0
+    g.metricas_linhas = 0
+    g.metricas_inicio = time.perf_counter()
+
+
+def _fim_pedido(resposta):
+    inicio = g.pop("metricas_inicio", None)
+    if inicio is None:
+        return resposta
+    rota = _rota()
+    latencia.observar((rota, "total"), time.perf_counter() - inicio)
+    if "admissao_espera" in g:
+        latencia.observar((rota, "admissao"), g.admissao_espera)
+    if "db_espera" in g:
+        # Só os pedidos que chegaram a ir à base de dados.
+        latencia.observar((rota, "pool"), g.db_espera)
+        latencia.observar((rota, "sql"), g.metricas_sql)
+    latencia.observar((rota, "serializacao"), g.metricas_serializacao)
+    pedidos.incrementar((rota, request.method, resposta.status_code))
+    if g.metricas_linhas:
+        linhas.incrementar((rota,), g.metricas_linhas)
+    return resposta
+
+
+def metrics_view():
+    return Response(texto(), mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app):
+    if not METRICAS_ATIVAS:
+        return
+    app.json = ProvedorJSON(app)
+    registo.observar(_observar_sql)
+    app.before_request(_inicio_pedido)
+    app.after_request(_fim_pedido)
+    app.add_url_rule("/metrics", "metrics", metrics_view, methods=("GET",))
@@ -0,0 +1,242 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Aplicação das migrations (migrations/NNNN_nome.sql) por ordem de versão.
+
+A tabela ``migracao`` guarda as versões já aplicadas, quando e quanto
+tempo demoraram; ``flask migrar aplicar`` corre as que faltam, cada uma na
+sua transação, e regista-as na mesma transação. Um advisory lock impede
+dois deploys de aplicarem migrations ao mesmo tempo.
+
+Um ficheiro com a linha ``-- migrar: sem transação`` corre fora
+de uma transação, uma instrução de cada vez, como o ``CREATE INDEX
+CONCURRENTLY`` exige (não bloqueia as escritas enquanto o índice é
+construído). Nesses ficheiros cada instrução acaba em ``;`` no fim de uma
+linha. Um ``CREATE INDEX CONCURRENTLY`` interrompido deixa o índice
+inválido; antes de o voltar a criar, o runner apaga-o.
+
+Numa base de dados onde as migrations já tinham sido aplicadas à mão,
+``flask migrar marcar VERSAO`` regista-as até VERSAO sem as correr.
+
+    flask --app app migrar estado
+    flask --app app migrar aplicar --planos --saida planos.json
+    flask --app app migrar planos
+"""
+import json
+import os
+import re
+import time
+
+import click
+from flask.cli import AppGroup
+from psycopg import sql
+
+import db
+import planos
+
+MIGRACOES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+SEM_TRANSACAO = "-- migrar: sem transação"
+
+_FICHEIRO = re.compile(r"^(\d{4})_(\w+)\.sql$")
+_CRIAR_INDICE = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE
+)
+
+CRIAR_MIGRACAO = '''
+    CREATE TABLE IF NOT EXISTS migracao (
+        versao integer PRIMARY KEY,
+        nome text NOT NULL,
+        aplicada_em timestamptz NOT NULL DEFAULT now(),
+        duracao_ms double precision
+    );
+'''
+
+BLOQUEAR = '''
+    SELECT pg_advisory_lock(hashtext('migracao'));
+'''
+
+DESBLOQUEAR = '''
+    SELECT pg_advisory_unlock(hashtext('migracao'));
+'''
+
+APLICADAS = '''
+    SELECT versao, nome, aplicada_em, duracao_ms
+    FROM migracao
+    ORDER BY versao;
+'''
+
+REGISTAR = '''
+    INSERT INTO migracao (versao, nome, duracao_ms)
+    VALUES (%(versao)s, %(nome)s, %(duracao_ms)s);
+'''
+
+INDICE_INVALIDO = '''
+    SELECT 1
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE
+        c.relname = %(nome)s AND
+        c.relnamespace = current_schema()::regnamespace AND
+        NOT i.indisvalid;
+'''
+
+
+class Migracao:
+    def __init__(self, versao, nome, caminho):
+        self.versao = versao
+        self.nome = nome
+        self.caminho = caminho
+
+    def texto(self):
+        with open(self.caminho, encoding="utf-8") as f:
+            return f.read()
+
+    def __repr__(self):
+        return f"Migracao({self.versao:04d}_{self.nome})"
+
+
+def migracoes(pasta=MIGRACOES):
+    """Todas as migrations da pasta, por ordem de versão."""
+    encontradas = []
+    for ficheiro in sorted(os.listdir(pasta)):
+        m = _FICHEIRO.match(ficheiro)
+        if m:
+            encontradas.append(Migracao(int(m.group(1)), m.group(2), os.path.join(pasta, ficheiro)))
+    return encontradas
+
+
+def _instrucoes(texto):
+    """Instruções de um ficheiro sem transação: sem comentários, separadas
+    pelos ``;`` em fim de linha."""
+    linhas = [linha for linha in texto.splitlines() if not linha.lstrip().startswith("--")]
+    return [i.strip() for i in re.split(r";\s*$", "\n".join(linhas), flags=re.MULTILINE) if i.strip()]
+
+
+def aplicadas(conn):
+    conn.execute(CRIAR_MIGRACAO)
+    with conn.cursor() as cur:
+        return {m.versao: m for m in cur.execute(APLICADAS).fetchall()}
+
+
+def aplicar(conn, migracao):
+    """Aplica uma migration e regista-a; devolve a duração em ms."""
+    texto = migracao.texto()
+    inicio = time.perf_counter()
+    if SEM_TRANSACAO in texto.splitlines():
+        for instrucao in _instrucoes(texto):
+            m = _CRIAR_INDICE.match(instrucao)
+            if m and conn.execute(INDICE_INVALIDO, {"nome": m.group(1)}).fetchone():
+                conn.execute(sql.SQL("DROP INDEX CONCURRENTLY {}").format(sql.Identifier(m.group(1))))
+            conn.execute(instrucao)
+        duracao_ms = (time.perf_counter() - inicio) * 1000
+        conn.execute(REGISTAR, {"versao": migracao.versao, "nome": migracao.nome, "duracao_ms": duracao_ms})
+    else:
+        with conn.transaction():
+            conn.execute(texto)
+            duracao_ms = (time.perf_counter() - inicio) * 1000
+            conn.execute(REGISTAR, {"versao": migracao.versao, "nome": migracao.nome, "duracao_ms": duracao_ms})
+    return duracao_ms
+
+
+def aplicar_pendentes(conn, ate=None, eco=print):
+    """Aplica por ordem as migrations ainda não aplicadas (até à versão
+    ``ate``); devolve as que aplicou."""
+    conn.execute(BLOQUEAR)
+    try:
+        feitas = aplicadas(conn)
+        pendentes = [m for m in migracoes() if m.versao not in feitas and (ate is None or m.versao <= ate)]
+        for migracao in pendentes:
+            eco(f"{migracao.versao:04d}_{migracao.nome}: {aplicar(conn, migracao):.0f} ms")
+        return pendentes
+    finally:
+        conn.execute(DESBLOQUEAR)
+
+
+def marcar(conn, ate):
+    """Regista como aplicadas, sem as correr, as migrations até ``ate``."""
+    conn.execute(BLOQUEAR)
+    try:
+        feitas = aplicadas(conn)
+        marcadas = [m for m in migracoes() if m.versao not in feitas and m.versao <= ate]
+        for migracao in marcadas:
+            conn.execute(REGISTAR, {"versao": migracao.versao, "nome": migracao.nome, "duracao_ms": None})
+        return marcadas
+    finally:
+        conn.execute(DESBLOQUEAR)
+
+
+migrar_cli = AppGroup("migrar", help="Migrations do esquema (migrations/).")
+
+
+@migrar_cli.command("estado")
+def estado_command():
+    """Lista as migrations e quando foram aplicadas."""
+    with db.ligacao() as conn:
+        feitas = aplicadas(conn)
+    for migracao in migracoes():
+        m = feitas.get(migracao.versao)
+        if m is None:
+            estado = "pendente"
+        elif m.duracao_ms is None:
+            estado = f"marcada em {m.aplicada_em:%Y-%m-%d %H:%M:%S}"
+        else:
+            estado = f"aplicada em {m.aplicada_em:%Y-%m-%d %H:%M:%S} ({m.duracao_ms:.0f} ms)"
+        click.echo(f"{migracao.versao:04d}_{migracao.nome:40} {estado}")
+
+
+def _guardar(saida, resultado):
+    with open(saida, "w") as f:
+        json.dump(resultado, f, indent=2, default=str)
+        f.write("\n")
+
+
+@migrar_cli.command("aplicar")
+@click.option("--ate", type=int, default=None, help="Última versão a aplicar.")
+@click.option("--planos", "com_planos", is_flag=True, help="Mede as queries das rotas antes e depois.")
+@click.option("--repeticoes", type=int, default=5, help="Execuções de cada query nas medições.")
+@click.option("--saida", default=None, help="Ficheiro JSON com as medições.")
+def aplicar_command(ate, com_planos, repeticoes, saida):
+    """Aplica as migrations pendentes."""
+    with db.ligacao() as conn:
+        antes = planos.medir(conn, repeticoes) if com_planos else None
+        aplicadas_agora = aplicar_pendentes(conn, ate, eco=click.echo)
+        if not aplicadas_agora:
+            click.echo("Nenhuma migration pendente.")
+        if not com_planos:
+            return
+        depois = planos.medir(conn, repeticoes)
+
+    for linha in planos.comparar(antes, depois):
+        click.echo(linha)
+    if saida:
+        _guardar(saida, {
+            "migracoes": [f"{m.versao:04d}_{m.nome}" for m in aplicadas_agora],
+            "antes": antes,
+            "depois": depois,
+        })
+
+
+@migrar_cli.command("marcar")
+@click.argument("versao", type=int)
+def marcar_command(versao):
+    """Regista as migrations até VERSAO como aplicadas, sem as correr."""
+    with db.ligacao() as conn:
+        for migracao in marcar(conn, versao):
+            click.echo(f"{migracao.versao:04d}_{migracao.nome}: marcada")
+
+
+@migrar_cli.command("planos")
+@click.option("--repeticoes", type=int, default=5, help="Execuções de cada query.")
+@click.option("--saida", default=None, help="Ficheiro JSON com as medições.")
+def planos_command(repeticoes, saida):
+    """Mede o tempo e o plano das queries de cada rota."""
+    with db.ligacao() as conn:
+        medicoes = planos.medir(conn, repeticoes)
+    for m in medicoes:
+        click.echo(f"{m['rota']:32} {m['consulta']:24} {m.get('tempo_ms', 'erro')!s:>10} ms")
+        click.echo(f"{'':34}{', '.join(m.get('acessos', [])) or m.get('erro')}")
+    if saida:
+        _guardar(saida, medicoes)
+
+
+def init_app(app):
+    app.cli.add_command(migrar_cli)
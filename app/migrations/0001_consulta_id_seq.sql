@@ -0,0 +1,16 @@
+-- Copyright (c) BDist Development Team
+-- Distributed under the terms of the Modified BSD License.
+--
+-- Ids de consulta passam a vir de uma sequência em vez de
+-- SELECT COALESCE(MAX(id), 0) + 1, que percorre a tabela a cada marcação e
+-- deixa duas marcações concorrentes escolher o mesmo id.
+--
+-- O levedura.py numera as consultas de 1 a N com ids explícitos, por isso a
+-- sequência é posta a seguir ao maior id existente. Voltar a correr este
+-- ficheiro depois de carregar mais dados volta a alinhá-la.
+
+CREATE SEQUENCE IF NOT EXISTS consulta_id_seq OWNED BY consulta.id;
+
+SELECT setval('consulta_id_seq', COALESCE((SELECT MAX(id) FROM consulta), 0) + 1, false);
+
+ALTER TABLE consulta ALTER COLUMN id SET DEFAULT nextval('consulta_id_seq');
@@ -0,0 +1,13 @@
+-- Copyright (c) BDist Development Team
+-- Distributed under the terms of the Modified BSD License.
+--
+-- Contador dos códigos SNS (ver codigos.py). Cada nextval reserva um bloco
+-- de INCREMENT BY contadores para um processo da API, que os transforma em
+-- códigos sem voltar à base de dados até o bloco se esgotar.
+--
+-- O levedura.py e o info.py usam o id da consulta como contador, por isso a
+-- sequência começa a seguir ao maior id existente.
+
+CREATE SEQUENCE IF NOT EXISTS codigo_sns_seq INCREMENT BY 100;
+
+SELECT setval('codigo_sns_seq', COALESCE((SELECT MAX(id) FROM consulta), 0) + 1, false);
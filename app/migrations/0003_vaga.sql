@@ -0,0 +1,17 @@
+-- Copyright (c) BDist Development Team
+-- Distributed under the terms of the Modified BSD License.
+--
+-- Índice de horários livres por médico e clínica (ver disponibilidade.py).
+-- As colunas têm os mesmos tipos que em consulta. Depois de aplicar, popular
+-- com `flask refrescar-vagas`.
+
+CREATE TABLE IF NOT EXISTS vaga AS
+SELECT nome, nif, data, hora
+FROM consulta
+WITH NO DATA;
+
+-- Leitura dos primeiros horários de um médico numa clínica.
+CREATE UNIQUE INDEX IF NOT EXISTS vaga_nome_nif_data_hora_key ON vaga (nome, nif, data, hora);
+
+-- Ocupar um horário de um médico em todas as clínicas onde trabalha.
+CREATE INDEX IF NOT EXISTS vaga_nif_data_hora_idx ON vaga (nif, data, hora);
@@ -0,0 +1,8 @@
+-- Copyright (c) BDist Development Team
+-- Distributed under the terms of the Modified BSD License.
+--
+-- Listagem paginada das consultas de uma clínica (/c/<clinica>/consultas/):
+-- a chave de paginação (data, hora, id) segue a ordem do índice depois do
+-- nome da clínica, por isso cada página é um range scan curto.
+
+CREATE INDEX IF NOT EXISTS consulta_nome_data_hora_id_idx ON consulta (nome, data, hora, id);
@@ -0,0 +1,25 @@
+-- Copyright (c) BDist Development Team
+-- Distributed under the terms of the Modified BSD License.
+--
+-- Fotografias do pg_stat_statements para o relatório de queries lentas
+-- (pgss.py, `flask pgss`, /admin/pgss/). A extensão tem de existir na base
+-- de dados da app: CREATE EXTENSION pg_stat_statements, como superutilizador.
+
+CREATE TABLE IF NOT EXISTS pgss_snapshot (
+    id serial PRIMARY KEY,
+    tirado_em timestamptz NOT NULL DEFAULT now(),
+    nome text
+);
+
+CREATE TABLE IF NOT EXISTS pgss_snapshot_linha (
+    snapshot integer NOT NULL REFERENCES pgss_snapshot ON DELETE CASCADE,
+    userid oid NOT NULL,
+    queryid bigint NOT NULL,
+    query text NOT NULL,
+    calls bigint NOT NULL,
+    total_exec_time double precision NOT NULL,
+    rows bigint NOT NULL,
+    shared_blks_hit bigint NOT NULL,
+    shared_blks_read bigint NOT NULL,
+    PRIMARY KEY (snapshot, userid, queryid)
+);
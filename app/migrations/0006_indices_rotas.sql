@@ -0,0 +1,24 @@
+-- Copyright (c) BDist Development Team
+-- Distributed under the terms of the Modified BSD License.
+--
+-- Índices para os acessos das rotas (ver planos.py e `flask migrar planos`).
+-- São construídos com CONCURRENTLY, sem bloquear as marcações, por isso
+-- este ficheiro corre fora de uma transação:
+-- migrar: sem transação
+
+-- Conflitos de horário do médico (validacao.py) e horários livres
+-- calculados na hora (disponibilidade.py, modos direto e agenda).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS consulta_nif_data_hora_idx ON consulta (nif, data, hora);
+
+-- Conflitos de horário do paciente ao marcar e a consulta a apagar ao cancelar.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS consulta_ssn_data_hora_idx ON consulta (ssn, data, hora);
+
+-- Receitas e observações de uma consulta pelo código SNS.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS consulta_codigo_sns_idx ON consulta (codigo_sns);
+
+-- Médicos de uma clínica num dia da semana; com o nif no índice, a
+-- listagem de especialidades e os candidatos das vagas não vão à tabela.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS trabalha_nome_dia_da_semana_idx ON trabalha (nome, dia_da_semana) INCLUDE (nif);
+
+-- Médicos de uma especialidade (disponibilidade.py).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS medico_especialidade_idx ON medico (especialidade) INCLUDE (nif, nome);
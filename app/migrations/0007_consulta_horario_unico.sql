@@ -0,0 +1,22 @@
+-- Copyright (c) BDist Development Team
+-- Distributed under the terms of the Modified BSD License.
+--
+-- Um médico e um paciente só podem ter uma consulta a cada hora. Com estes
+-- índices únicos, duas marcações simultâneas do mesmo horário passam ambas
+-- a validação mas só uma é inserida: a outra cai no ON CONFLICT DO NOTHING
+-- de MARCAR (consultas.py) e recebe um 409, sem exceção nem rollback.
+-- Substituem os índices simples de 0006_indices_rotas.sql, com as mesmas
+-- colunas.
+--
+-- A construção falha se já houver horários repetidos, que se encontram com
+--     SELECT nif, data, hora FROM consulta GROUP BY 1, 2, 3 HAVING count(*) > 1;
+-- (e o mesmo para ssn); depois de os resolver, voltar a correr `flask migrar aplicar`.
+-- migrar: sem transação
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS consulta_nif_data_hora_key ON consulta (nif, data, hora);
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS consulta_ssn_data_hora_key ON consulta (ssn, data, hora);
+
+DROP INDEX CONCURRENTLY IF EXISTS consulta_nif_data_hora_idx;
+
+DROP INDEX CONCURRENTLY IF EXISTS consulta_ssn_data_hora_idx;
@@ -0,0 +1,165 @@
+-- Copyright (c) BDist Development Team
+-- Distributed under the terms of the Modified BSD License.
+--
+-- Avisos de invalidação da cache (notificacoes.py): cada instrução que muda
+-- consulta, trabalha, medico ou clinica faz NOTIFY no canal saude_cache,
+-- no commit, com as entradas da cache que deixaram de estar certas:
+--
+--     {"clinicas": true, "especialidades": [clinica, ...],
+--      "vagas": [[clinica, especialidade], ...]}
+--
+-- ou {"tudo": true} depois de um TRUNCATE, ou se a lista não couber num
+-- aviso. Os triggers são por instrução, com as tabelas de transição, para
+-- um lote de marcações ou um COPY darem um só aviso.
+
+CREATE OR REPLACE FUNCTION notificar_cache(aviso jsonb) RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    aviso := jsonb_strip_nulls(aviso);
+    IF aviso = '{}' OR aviso = '{"vagas": []}' THEN
+        RETURN;
+    END IF;
+    -- Um aviso tem no máximo 8000 bytes.
+    IF octet_length(aviso::text) > 7900 THEN
+        aviso := '{"tudo": true}';
+    END IF;
+    PERFORM pg_notify('saude_cache', aviso::text);
+END
+$$;
+
+-- Pares [clinica, especialidade] das vagas dos médicos nifs, nas clínicas
+-- onde trabalham (como _afetadas em consultas.py).
+CREATE OR REPLACE FUNCTION cache_vagas(nifs text[]) RETURNS jsonb
+LANGUAGE sql STABLE AS $$
+    SELECT COALESCE(jsonb_agg(DISTINCT jsonb_build_array(tr.nome, m.especialidade)), '[]')
+    FROM medico m
+    JOIN trabalha tr ON tr.nif = m.nif
+    WHERE m.nif = ANY(nifs);
+$$;
+
+CREATE OR REPLACE FUNCTION notificar_cache_consulta() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    nifs text[] := '{}';
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        nifs := nifs || ARRAY(SELECT DISTINCT nif::text FROM novas);
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        nifs := nifs || ARRAY(SELECT DISTINCT nif::text FROM antigas);
+    END IF;
+    PERFORM notificar_cache(jsonb_build_object('vagas', cache_vagas(nifs)));
+    RETURN NULL;
+END
+$$;
+
+-- As linhas de trabalha que mudam dizem as clínicas e as especialidades
+-- afetadas, mesmo as que deixaram de existir.
+CREATE OR REPLACE FUNCTION notificar_cache_trabalha() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    linhas jsonb := '[]';
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        linhas := linhas || COALESCE((
+            SELECT jsonb_agg(jsonb_build_array(t.nome, m.especialidade))
+            FROM novas t JOIN medico m ON m.nif = t.nif
+        ), '[]');
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        linhas := linhas || COALESCE((
+            SELECT jsonb_agg(jsonb_build_array(t.nome, m.especialidade))
+            FROM antigas t JOIN medico m ON m.nif = t.nif
+        ), '[]');
+    END IF;
+    PERFORM notificar_cache(jsonb_build_object(
+        'especialidades', (SELECT jsonb_agg(DISTINCT p->0) FROM jsonb_array_elements(linhas) p),
+        'vagas', (SELECT COALESCE(jsonb_agg(DISTINCT p), '[]') FROM jsonb_array_elements(linhas) p)
+    ));
+    RETURN NULL;
+END
+$$;
+
+-- Um médico que muda de nome ou de especialidade muda as especialidades e
+-- as vagas das clínicas onde trabalha, com a especialidade antiga e a nova.
+CREATE OR REPLACE FUNCTION notificar_cache_medico() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    linhas jsonb := '[]';
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        linhas := linhas || COALESCE((
+            SELECT jsonb_agg(jsonb_build_array(tr.nome, m.especialidade))
+            FROM novas m JOIN trabalha tr ON tr.nif = m.nif
+        ), '[]');
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        linhas := linhas || COALESCE((
+            SELECT jsonb_agg(jsonb_build_array(tr.nome, m.especialidade))
+            FROM antigas m JOIN trabalha tr ON tr.nif = m.nif
+        ), '[]');
+    END IF;
+    PERFORM notificar_cache(jsonb_build_object(
+        'especialidades', (SELECT jsonb_agg(DISTINCT p->0) FROM jsonb_array_elements(linhas) p),
+        'vagas', (SELECT COALESCE(jsonb_agg(DISTINCT p), '[]') FROM jsonb_array_elements(linhas) p)
+    ));
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION notificar_cache_clinica() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    nomes jsonb := '[]';
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        nomes := nomes || COALESCE((SELECT jsonb_agg(nome) FROM novas), '[]');
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        nomes := nomes || COALESCE((SELECT jsonb_agg(nome) FROM antigas), '[]');
+    END IF;
+    PERFORM notificar_cache(jsonb_build_object(
+        'clinicas', true,
+        'especialidades', (SELECT jsonb_agg(DISTINCT n) FROM jsonb_array_elements(nomes) n)
+    ));
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION notificar_cache_tudo() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM notificar_cache('{"tudo": true}');
+    RETURN NULL;
+END
+$$;
+
+-- Um trigger por tabela e por operação: as tabelas de transição só existem
+-- em triggers de uma só operação.
+DO $$
+DECLARE
+    tabela text;
+BEGIN
+    FOREACH tabela IN ARRAY ARRAY['consulta', 'trabalha', 'medico', 'clinica'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %1$s_notificar_cache_insert ON %1$I', tabela);
+        EXECUTE format('DROP TRIGGER IF EXISTS %1$s_notificar_cache_update ON %1$I', tabela);
+        EXECUTE format('DROP TRIGGER IF EXISTS %1$s_notificar_cache_delete ON %1$I', tabela);
+        EXECUTE format('DROP TRIGGER IF EXISTS %1$s_notificar_cache_truncate ON %1$I', tabela);
+        EXECUTE format(
+            'CREATE TRIGGER %1$s_notificar_cache_insert AFTER INSERT ON %1$I '
+            'REFERENCING NEW TABLE AS novas '
+            'FOR EACH STATEMENT EXECUTE FUNCTION notificar_cache_%1$s()', tabela);
+        EXECUTE format(
+            'CREATE TRIGGER %1$s_notificar_cache_update AFTER UPDATE ON %1$I '
+            'REFERENCING OLD TABLE AS antigas NEW TABLE AS novas '
+            'FOR EACH STATEMENT EXECUTE FUNCTION notificar_cache_%1$s()', tabela);
+        EXECUTE format(
+            'CREATE TRIGGER %1$s_notificar_cache_delete AFTER DELETE ON %1$I '
+            'REFERENCING OLD TABLE AS antigas '
+            'FOR EACH STATEMENT EXECUTE FUNCTION notificar_cache_%1$s()', tabela);
+        EXECUTE format(
+            'CREATE TRIGGER %1$s_notificar_cache_truncate AFTER TRUNCATE ON %1$I '
+            'FOR EACH STATEMENT EXECUTE FUNCTION notificar_cache_tudo()', tabela);
+    END LOOP;
+END
+$$;
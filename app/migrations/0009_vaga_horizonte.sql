@@ -0,0 +1,16 @@
+-- Copyright (c) BDist Development Team
+-- Distributed under the terms of the Modified BSD License.
+--
+-- Último dia que a tabela vaga (0003_vaga.sql) cobre. Com o horizonte
+-- atrasado, /c/<clinica>/<especialidade>/ calcula as vagas na hora e a app
+-- acrescenta os dias em falta (disponibilidade.py); `flask refrescar-vagas`
+-- reconstrói a tabela e o horizonte. Uma só linha, a começar por ontem: a
+-- tabela conta como desatualizada até à primeira extensão.
+
+CREATE TABLE IF NOT EXISTS vaga_horizonte (
+    ate date NOT NULL
+);
+
+INSERT INTO vaga_horizonte (ate)
+SELECT CURRENT_DATE - 1
+WHERE NOT EXISTS (SELECT 1 FROM vaga_horizonte);
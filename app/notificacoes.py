@@ -0,0 +1,105 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Invalidação da cache a partir dos avisos do Postgres (LISTEN/NOTIFY).
+
+Os triggers de migrations/0008_notificar_cache.sql avisam no canal
+``saude_cache``, no commit de cada alteração a consulta, trabalha, medico ou
+clinica, quais as entradas da cache que mudaram. Cada worker tem uma thread
+com uma ligação própria ao primário (fora do pool, à escuta no canal), que
+passa cada aviso aos ganchos ``invalidar_*`` de cache.py. Assim as
+alterações feitas por outro worker, ou fora da API (psql, levedura.py),
+chegam à cache local de todos os workers, e o ``CACHE_TTL`` pode ser longo.
+
+Os avisos feitos enquanto a ligação está em baixo perdem-se: ao voltar a
+ligar, a thread invalida a cache toda.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import psycopg
+from psycopg import sql
+
+import db
+from cache import invalidar_clinicas, invalidar_especialidades, invalidar_vagas
+
+log = logging.getLogger(__name__)
+
+NOTIFICACOES_ATIVAS = os.environ.get("NOTIFICACOES_ATIVAS", "1") != "0"
+CANAL = "saude_cache"
+# Segundos antes de voltar a ligar, depois de perder a ligação.
+_PAUSA = 1
+
+
+def aplicar(aviso):
+    """Invalida as entradas da cache indicadas num aviso (ver a migration)."""
+    if aviso.get("tudo"):
+        invalidar_clinicas()
+        invalidar_especialidades()
+        invalidar_vagas()
+        return
+    if aviso.get("clinicas"):
+        invalidar_clinicas()
+    for clinica in aviso.get("especialidades", ()):
+        invalidar_especialidades(clinica)
+    if aviso.get("vagas"):
+        invalidar_vagas({tuple(par) for par in aviso["vagas"]})
+
+
+class Ouvinte:
+    """A thread que escuta o canal, uma por processo."""
+
+    def __init__(self, url=db.DATABASE_URL, canal=CANAL):
+        self.url = url
+        self.canal = canal
+        self.ligado = False
+        self.recebidos = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        """Arranca a thread, se ainda não estiver a correr neste processo
+        (depois de um fork, a do processo pai não está)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._ouvir, name="notificacoes", daemon=True)
+                self._thread.start()
+
+    def _ouvir(self):
+        perdeu_avisos = False
+        while True:
+            try:
+                with psycopg.connect(
+                    self.url, autocommit=True, application_name=f"{db.DATABASE_APPLICATION_NAME}-notificacoes"
+                ) as conn:
+                    conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.canal)))
+                    self.ligado = True
+                    if perdeu_avisos:
+                        aplicar({"tudo": True})
+                        perdeu_avisos = False
+                    for notificacao in conn.notifies():
+                        self.recebidos += 1
+                        try:
+                            aplicar(json.loads(notificacao.payload))
+                        except (ValueError, TypeError, AttributeError) as e:
+                            log.warning(f"Aviso de cache inválido {notificacao.payload!r}: {e}")
+            except psycopg.Error as e:
+                log.warning(f"Sem ligação para os avisos de cache: {e}")
+            self.ligado = False
+            perdeu_avisos = True
+            time.sleep(_PAUSA)
+
+
+ouvinte = Ouvinte()
+
+
+def init_app(app):
+    if not NOTIFICACOES_ATIVAS:
+        return
+    # A thread arranca no primeiro pedido de cada processo (o gunicorn
+    # arranca-a logo depois do fork, em post_fork).
+    app.before_request(ouvinte.iniciar)
@@ -0,0 +1,198 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Relatório de queries lentas a partir do pg_stat_statements.
+
+Uma fotografia (snapshot) guarda os contadores cumulativos de cada statement
+da base de dados da app nas tabelas de migrations/0005_pgss_snapshot.sql; a
+diferença entre duas fotografias dá o que correu entre elas, ordenado pelo
+tempo total ou pelo tempo médio por execução.
+
+Cada statement é ligado à rota e à função Flask que o executou pelo
+comentário que o registo de queries preparadas lhe acrescenta (ver
+preparadas.py): o pg_stat_statements ignora os comentários ao agrupar, mas
+guarda o texto da primeira execução, com o comentário. Uma query usada por
+várias rotas (a reserva de códigos SNS, HORARIOS_TOMADOS) é por isso um só
+statement, atribuído todo à rota que a executou primeiro: a atribuição
+dessas é aproximada. O relatório junta a cada statement, em ``contextos``,
+todas as rotas em que o processo que o calcula viu a query correr (vazio na
+CLI, que não atende pedidos; completo em /admin/pgss/relatorio/ de um
+worker com tráfego). As ligações à base de dados identificam-se também com
+``application_name`` (db.py), para o pg_stat_activity.
+
+    flask --app app pgss snapshot --nome antes
+    flask --app app pgss snapshots
+    flask --app app pgss relatorio 1 2 --ordem media
+"""
+import re
+from urllib.parse import unquote
+
+import click
+from flask import has_request_context, request
+from flask.cli import AppGroup
+
+import db
+from preparadas import registo
+
+TIRAR_SNAPSHOT = '''
+    WITH s AS (
+        INSERT INTO pgss_snapshot (nome) VALUES (%(nome)s)
+        RETURNING id, tirado_em
+    ), l AS (
+        INSERT INTO pgss_snapshot_linha (
+            snapshot, userid, queryid, query, calls, total_exec_time, rows,
+            shared_blks_hit, shared_blks_read
+        )
+        SELECT
+            s.id, p.userid, p.queryid, min(p.query), sum(p.calls), sum(p.total_exec_time),
+            sum(p.rows), sum(p.shared_blks_hit), sum(p.shared_blks_read)
+        FROM s, pg_stat_statements p
+        WHERE
+            p.dbid = (SELECT oid FROM pg_database WHERE datname = current_database()) AND
+            p.queryid IS NOT NULL
+        GROUP BY s.id, p.userid, p.queryid
+        RETURNING 1
+    )
+    SELECT s.id, s.tirado_em, (SELECT count(*) FROM l) AS statements
+    FROM s;
+'''
+
+LISTAR_SNAPSHOTS = '''
+    SELECT s.id, s.tirado_em, s.nome, count(l.queryid) AS statements
+    FROM pgss_snapshot s
+    LEFT JOIN pgss_snapshot_linha l ON l.snapshot = s.id
+    GROUP BY s.id
+    ORDER BY s.id DESC
+    LIMIT %(limite)s;
+'''
+
+# Diferença entre as fotografias <de> e <ate>. Um statement que não existia
+# em <de>, ou cujos contadores baixaram (pg_stat_statements_reset ou
+# statement despejado e recriado), conta desde zero.
+RELATORIO = '''
+    SELECT *
+    FROM (
+        SELECT
+            b.queryid,
+            b.query,
+            b.calls - COALESCE(a.calls, 0) AS calls,
+            b.total_exec_time - COALESCE(a.total_exec_time, 0) AS total_ms,
+            (b.total_exec_time - COALESCE(a.total_exec_time, 0)) / (b.calls - COALESCE(a.calls, 0)) AS media_ms,
+            b.rows - COALESCE(a.rows, 0) AS rows,
+            b.shared_blks_hit - COALESCE(a.shared_blks_hit, 0) AS blks_hit,
+            b.shared_blks_read - COALESCE(a.shared_blks_read, 0) AS blks_read
+        FROM pgss_snapshot_linha b
+        LEFT JOIN pgss_snapshot_linha a ON
+            a.snapshot = %(de)s AND
+            a.userid = b.userid AND
+            a.queryid = b.queryid AND
+            a.calls <= b.calls
+        WHERE b.snapshot = %(ate)s AND b.calls > COALESCE(a.calls, 0)
+    ) d
+    ORDER BY CASE WHEN %(ordem)s = 'media' THEN d.media_ms ELSE d.total_ms END DESC
+    LIMIT %(limite)s;
+'''
+
+_COMENTARIO = re.compile(r"^\s*/\*(.*?)\*/")
+_ETIQUETA = re.compile(r"(\w+)='([^']*)'")
+
+
+def etiquetas(query):
+    """Etiquetas sqlcommenter do comentário inicial de uma query."""
+    m = _COMENTARIO.match(query)
+    if m is None:
+        return {}
+    return {nome: unquote(valor) for nome, valor in _ETIQUETA.findall(m.group(1))}
+
+
+def _sem_comentario(query, tamanho=200):
+    return " ".join(_COMENTARIO.sub("", query, count=1).split())[:tamanho]
+
+
+def tirar_snapshot(cur, nome=None):
+    return cur.execute(TIRAR_SNAPSHOT, {"nome": nome}).fetchone()
+
+
+def snapshots(cur, limite=50):
+    return cur.execute(LISTAR_SNAPSHOTS, {"limite": limite}).fetchall()
+
+
+def relatorio(cur, de, ate=None, ordem="total", limite=20):
+    """Statements que mais tempo gastaram entre as fotografias ``de`` e
+    ``ate`` (sem ``ate``, tira-se uma agora), por ``ordem`` "total" ou
+    "media", com a rota e a função da primeira execução e os contextos
+    conhecidos da query (ver a docstring do módulo)."""
+    if ate is None:
+        ate = tirar_snapshot(cur, "relatorio").id
+    linhas = cur.execute(RELATORIO, {"de": de, "ate": ate, "ordem": ordem, "limite": limite}).fetchall()
+    resultado = []
+    for r in linhas:
+        e = etiquetas(r.query)
+        resultado.append({
+            "queryid": r.queryid,
+            "consulta": e.get("consulta"),
+            "rota": e.get("rota"),
+            "funcao": e.get("funcao"),
+            "contextos": registo.contextos(e.get("consulta")),
+            "calls": r.calls,
+            "total_ms": round(r.total_ms, 3),
+            "media_ms": round(r.media_ms, 3),
+            "rows": r.rows,
+            "hit_ratio": round(r.blks_hit / (r.blks_hit + r.blks_read), 4) if r.blks_hit + r.blks_read else None,
+            "query": _sem_comentario(r.query),
+        })
+    return {"de": de, "ate": ate, "ordem": ordem, "statements": resultado}
+
+
+def _etiquetas_do_pedido():
+    if not has_request_context() or request.url_rule is None:
+        return ()
+    return (("rota", request.url_rule.rule), ("funcao", request.endpoint))
+
+
+pgss_cli = AppGroup("pgss", help="Relatório de queries lentas (pg_stat_statements).")
+
+
+@pgss_cli.command("snapshot")
+@click.option("--nome", default=None, help="Etiqueta da fotografia.")
+def snapshot_command(nome):
+    """Tira uma fotografia do pg_stat_statements."""
+    with db.ligacao() as conn:
+        s = tirar_snapshot(conn.cursor(), nome)
+    click.echo(f"Fotografia {s.id} ({s.statements} statements) em {s.tirado_em:%Y-%m-%d %H:%M:%S}.")
+
+
+@pgss_cli.command("snapshots")
+def snapshots_command():
+    """Lista as últimas fotografias."""
+    with db.ligacao() as conn:
+        for s in snapshots(conn.cursor()):
+            click.echo(f"{s.id:>5}  {s.tirado_em:%Y-%m-%d %H:%M:%S}  {s.statements:>6} statements  {s.nome or ''}")
+
+
+@pgss_cli.command("relatorio")
+@click.argument("de", type=int)
+@click.argument("ate", type=int, required=False)
+@click.option("--ordem", type=click.Choice(["total", "media"]), default="total")
+@click.option("--limite", type=int, default=20)
+def relatorio_command(de, ate, ordem, limite):
+    """Statements mais pesados entre as fotografias DE e ATE (ou agora)."""
+    with db.ligacao() as conn:
+        r = relatorio(conn.cursor(), de, ate, ordem, limite)
+    click.echo(f"Entre as fotografias {r['de']} e {r['ate']}, por tempo {ordem}:")
+    click.echo(
+        "(rota e função da primeira execução: uma query usada por várias rotas "
+        "conta toda para essa)"
+    )
+    click.echo(f"{'total ms':>12} {'média ms':>10} {'calls':>8}  {'consulta':24} {'função':24} rota")
+    for s in r["statements"]:
+        click.echo(
+            f"{s['total_ms']:>12.1f} {s['media_ms']:>10.3f} {s['calls']:>8}  "
+            f"{s['consulta'] or '-':24} {s['funcao'] or '-':24} {s['rota'] or '-'}"
+        )
+        if s["consulta"] is None:
+            click.echo(f"{'':34}{s['query']}")
+
+
+def init_app(app):
+    registo.etiquetar = _etiquetas_do_pedido
+    app.cli.add_command(pgss_cli)
@@ -0,0 +1,129 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Plano e tempo das queries de cada rota, para comparar antes e depois de
+uma migration (``flask migrar aplicar --planos``).
+
+Os parâmetros saem da consulta mais recente da base de dados, para as
+queries encontrarem linhas como nos pedidos reais. Cada query corre
+``repeticoes`` vezes (conta a mediana) e uma vez com ``EXPLAIN (ANALYZE,
+BUFFERS)``, de onde saem o tempo de planeamento e de execução do servidor e
+os acessos a tabelas e índices. Tudo corre numa transação desfeita no fim,
+por isso as marcações e os cancelamentos não ficam na base de dados.
+"""
+import json
+import statistics
+import time
+from datetime import timedelta
+
+import psycopg
+
+from consultas import CANCELAR, LISTAR_CLINICAS, LISTAR_CONSULTAS, LISTAR_ESPECIALIDADES, MARCAR
+from disponibilidade import MEDICOS_E_MASCARAS, PRIMEIRAS_VAGAS, PRIMEIRAS_VAGAS_DIRETO, parametros
+from validacao import VALIDAR_CANCELAMENTO, VALIDAR_MARCACAO
+
+AMOSTRA = '''
+    SELECT c.ssn, c.nif, c.nome AS clinica, c.data, c.hora, m.especialidade
+    FROM consulta c
+    JOIN medico m ON m.nif = c.nif
+    ORDER BY c.data DESC, c.hora DESC
+    LIMIT 1;
+'''
+
+
+def _queries(a):
+    """(rota, query, parâmetros) de cada query das rotas, para a amostra ``a``."""
+    vagas = parametros(clinica=a.clinica, especialidade=a.especialidade, limite=3)
+    # Uma semana depois da amostra: o mesmo dia da semana, em que o médico
+    # trabalha na clínica, e provavelmente ainda livre.
+    marcacao = {"ssn": a.ssn, "nif": a.nif, "data": a.data + timedelta(days=7), "hora": a.hora}
+    return (
+        ("/", LISTAR_CLINICAS, {}),
+        ("/c/<clinica>/", LISTAR_ESPECIALIDADES, {"clinica": a.clinica}),
+        ("/c/<clinica>/<especialidade>/", PRIMEIRAS_VAGAS, vagas),
+        ("/c/<clinica>/<especialidade>/", PRIMEIRAS_VAGAS_DIRETO, vagas),
+        ("/c/<clinica>/<especialidade>/", MEDICOS_E_MASCARAS, vagas),
+        (
+            "/c/<clinica>/consultas/",
+            LISTAR_CONSULTAS,
+            {"clinica": a.clinica, "data": None, "hora": None, "id": None, "de": None, "ate": None, "limite": 101},
+        ),
+        ("/a/<clinica>/registar/", VALIDAR_MARCACAO, {**marcacao, "clinica": a.clinica}),
+        ("/a/<clinica>/registar/", MARCAR, {**marcacao, "clinica_nome": a.clinica, "codigo_sns": "999999999999"}),
+        ("/a/<clinica>/cancelar/", VALIDAR_CANCELAMENTO, {"ssn": a.ssn, "nif": a.nif}),
+        (
+            "/a/<clinica>/cancelar/",
+            CANCELAR,
+            parametros(clinica=a.clinica, ssn=a.ssn, nif=a.nif, data=a.data, hora=a.hora),
+        ),
+    )
+
+
+def _acessos(no, acessos):
+    """Tabelas e índices lidos pelo plano, pela ordem em que aparecem."""
+    if "Relation Name" in no or "Index Name" in no:
+        acesso = no["Node Type"]
+        if "Index Name" in no:
+            acesso += f" {no['Index Name']}"
+        if "Relation Name" in no:
+            acesso += f" on {no['Relation Name']}"
+        if acesso not in acessos:
+            acessos.append(acesso)
+    for filho in no.get("Plans", ()):
+        _acessos(filho, acessos)
+    return acessos
+
+
+def _medir(cur, query, params, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        with cur.connection.transaction(force_rollback=True):
+            inicio = time.perf_counter()
+            cur.execute(query.texto, params)
+            cur.fetchall()
+            tempos.append(time.perf_counter() - inicio)
+    with cur.connection.transaction(force_rollback=True):
+        plano = cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query.texto, params).fetchone()[0]
+    if isinstance(plano, str):
+        plano = json.loads(plano)
+    plano = plano[0]
+    return {
+        "tempo_ms": round(statistics.median(tempos) * 1000, 3),
+        "planeamento_ms": plano["Planning Time"],
+        "execucao_ms": plano["Execution Time"],
+        "acessos": _acessos(plano["Plan"], []),
+    }
+
+
+def medir(conn, repeticoes=5):
+    """Tempo e plano de cada query das rotas; lista de dicionários pela
+    ordem das rotas."""
+    # Com os valores no texto, como um cliente que não prepara, para o
+    # EXPLAIN ver os mesmos parâmetros que a execução.
+    with psycopg.ClientCursor(conn) as cur:
+        amostra = cur.execute(AMOSTRA).fetchone()
+        if amostra is None:
+            raise ValueError("A tabela consulta está vazia; não há parâmetros para as queries.")
+        resultados = []
+        for rota, query, params in _queries(amostra):
+            resultado = {"rota": rota, "consulta": query.nome}
+            try:
+                resultado.update(_medir(cur, query, params, repeticoes))
+            except psycopg.Error as e:
+                resultado["erro"] = str(e).strip()
+            resultados.append(resultado)
+    return resultados
+
+
+def comparar(antes, depois):
+    """Linhas de texto com a variação de cada query entre duas medições."""
+    linhas = [f"{'rota':32} {'consulta':24} {'antes ms':>10} {'depois ms':>10}"]
+    depois = {(d["rota"], d["consulta"]): d for d in depois}
+    for a in antes:
+        d = depois.get((a["rota"], a["consulta"]), {})
+        linhas.append(
+            f"{a['rota']:32} {a['consulta']:24} {a.get('tempo_ms', 'erro')!s:>10} {d.get('tempo_ms', 'erro')!s:>10}"
+        )
+        if a.get("acessos") != d.get("acessos"):
+            linhas.append(f"{'':34}antes:  {', '.join(a.get('acessos', [])) or a.get('erro')}")
+            linhas.append(f"{'':34}depois: {', '.join(d.get('acessos', [])) or d.get('erro')}")
+    return linhas
@@ -0,0 +1,150 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Registo central das queries frequentes da API.
+
+Cada query tem um nome e é executada como prepared statement: na primeira
+execução numa ligação o psycopg prepara-a no servidor e, daí em diante, essa
+ligação do pool só envia os parâmetros, sem o Postgres voltar a fazer o parse
+e o planeamento. O registo conta também as execuções, os erros e o tempo de
+cada query, que ``GET /admin/sql/`` mostra ordenados pelo tempo total.
+
+As queries são declaradas nos módulos que as usam:
+
+    LISTAR_CLINICAS = preparada("listar_clinicas", '''SELECT ...''')
+
+e executadas com ``executar(cur, LISTAR_CLINICAS, params)``.
+
+Cada query segue para o servidor com um comentário no formato do
+sqlcommenter, ``/*consulta='listar_clinicas',rota='/',funcao='clinicas_view'*/``,
+com o nome no registo e, se ``Registo.etiquetar`` estiver definido, a rota e
+a função que a executaram; é assim que o relatório do pg_stat_statements
+(pgss.py) liga cada statement ao código.
+"""
+import threading
+import time
+from urllib.parse import quote
+
+
+class Preparada:
+    """Uma query do registo: o nome pelo qual é reportada e o texto SQL."""
+
+    __slots__ = ("nome", "texto")
+
+    def __init__(self, nome, texto):
+        self.nome = nome
+        self.texto = texto
+
+    def __repr__(self):
+        return f"Preparada({self.nome!r})"
+
+
+def _opcoes(cur):
+    # Os cursores do lado do servidor (com nome, ver a exportação de
+    # /c/<clinica>/consultas/) são um DECLARE e não aceitam ``prepare``.
+    return {} if getattr(cur, "name", None) else {"prepare": True}
+
+
+class Registo:
+    def __init__(self):
+        self._preparadas = {}
+        self._contadores = {}
+        self._observadores = []
+        self._textos = {}
+        # Contextos (etiquetas além do nome) em que cada query já correu.
+        self._contextos = {}
+        self._lock = threading.Lock()
+        # Função sem argumentos que devolve pares (etiqueta, valor) do
+        # contexto da execução, por exemplo a rota do pedido (ver pgss.py).
+        self.etiquetar = None
+
+    def registar(self, nome, texto):
+        if nome in self._preparadas:
+            raise ValueError(f"Já existe uma query registada com o nome {nome}.")
+        preparada = self._preparadas[nome] = Preparada(nome, texto)
+        self._contadores[nome] = {"execucoes": 0, "erros": 0, "tempo_total": 0.0, "tempo_max": 0.0}
+        self._contextos[nome] = set()
+        return preparada
+
+    def observar(self, observador):
+        """Regista ``observador(preparada, segundos, erro, cur)``, chamado
+        depois de cada execução (ver metricas.py)."""
+        self._observadores.append(observador)
+
+    def _texto(self, preparada):
+        """Texto da query com o comentário de etiquetas. Há um texto (e por
+        isso um prepared statement) por cada contexto em que a query corre,
+        que são poucos: as rotas que a usam."""
+        etiquetas = (("consulta", preparada.nome), *(self.etiquetar() if self.etiquetar else ()))
+        texto = self._textos.get(etiquetas)
+        if texto is None:
+            comentario = ",".join(f"{nome}='{quote(str(valor), safe='/<>')}'" for nome, valor in etiquetas)
+            texto = self._textos[etiquetas] = f"/*{comentario}*/{preparada.texto}"
+            if len(etiquetas) > 1:
+                with self._lock:
+                    self._contextos[preparada.nome].add(etiquetas[1:])
+        return texto
+
+    def contextos(self, nome):
+        """Os contextos (por exemplo, rota e função) em que a query ``nome``
+        já correu neste processo, como dicionários. O pg_stat_statements
+        junta as execuções de todos num só statement."""
+        with self._lock:
+            return [dict(c) for c in sorted(self._contextos.get(nome, ()))]
+
+    def _contar(self, preparada, segundos, erro, cur):
+        with self._lock:
+            c = self._contadores[preparada.nome]
+            c["execucoes"] += 1
+            c["erros"] += erro
+            c["tempo_total"] += segundos
+            c["tempo_max"] = max(c["tempo_max"], segundos)
+        for observador in self._observadores:
+            observador(preparada, segundos, erro, cur)
+
+    def executar(self, cur, preparada, params=None):
+        """``cur.execute`` da query preparada; devolve o cursor."""
+        inicio, erro = time.perf_counter(), True
+        try:
+            cur.execute(self._texto(preparada), params, **_opcoes(cur))
+            erro = False
+            return cur
+        finally:
+            self._contar(preparada, time.perf_counter() - inicio, erro, cur)
+
+    async def executar_async(self, acur, preparada, params=None):
+        """``executar`` para um cursor assíncrono (asgi.py)."""
+        inicio, erro = time.perf_counter(), True
+        try:
+            await acur.execute(self._texto(preparada), params, **_opcoes(acur))
+            erro = False
+            return acur
+        finally:
+            self._contar(preparada, time.perf_counter() - inicio, erro, acur)
+
+    def estatisticas(self):
+        """Contadores por query, da que gastou mais tempo para a que gastou menos."""
+        with self._lock:
+            contadores = {nome: dict(c) for nome, c in self._contadores.items()}
+        return [
+            {
+                "nome": nome,
+                "execucoes": c["execucoes"],
+                "erros": c["erros"],
+                "tempo_total_ms": round(c["tempo_total"] * 1000, 3),
+                "tempo_medio_ms": round(c["tempo_total"] * 1000 / c["execucoes"], 3) if c["execucoes"] else None,
+                "tempo_max_ms": round(c["tempo_max"] * 1000, 3),
+                "contextos": self.contextos(nome),
+            }
+            for nome, c in sorted(contadores.items(), key=lambda item: -item[1]["tempo_total"])
+        ]
+
+    def reiniciar(self):
+        with self._lock:
+            for c in self._contadores.values():
+                c.update(execucoes=0, erros=0, tempo_total=0.0, tempo_max=0.0)
+
+
+registo = Registo()
+preparada = registo.registar
+executar = registo.executar
+executar_async = registo.executar_async
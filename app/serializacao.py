@@ -0,0 +1,112 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Serialização JSON das respostas da API.
+
+As rotas devolvem linhas do psycopg (``namedtuple_row``) com datas e horas;
+o provedor JSON do Flask trata-as assim, sem cada rota ter de construir
+dicionários e formatar datas à mão:
+
+* um namedtuple é um objeto JSON com os campos da linha;
+* ``date``, ``time`` e ``datetime`` vão em ISO 8601 (``2024-01-02``, ``09:30:00``);
+* ``Decimal`` vai como texto, para não perder casas decimais.
+
+Com o orjson instalado (opcional), a conversão corre toda em C e devolve
+logo os bytes da resposta; sem ele, as linhas são convertidas em Python e
+serializadas pelo módulo ``json``, com o mesmo resultado. Em ambos os casos
+as chaves vão ordenadas, com separadores compactos e em UTF-8, sem escapar
+os acentos. ``bench/json_linhas.py`` compara o custo por 10 mil linhas.
+"""
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # O orjson é opcional: sem ele a serialização é a do módulo json.
+    orjson = None
+
+
+def _e_namedtuple(obj):
+    return isinstance(obj, tuple) and hasattr(obj, "_asdict")
+
+
+def _padrao(obj):
+    """Valores que o orjson não serializa sozinho."""
+    if _e_namedtuple(obj):
+        return obj._asdict()
+    if isinstance(obj, Decimal):
+        return str(obj)
+    return DefaultJSONProvider.default(obj)
+
+
+_SIMPLES = frozenset((str, int, float, bool, type(None)))
+_CONVERSORES = {date: date.isoformat, time: time.isoformat, datetime: datetime.isoformat, Decimal: str}
+
+
+def _converter(obj):
+    """Cópia de ``obj`` só com tipos do módulo json, para quando não há orjson:
+    o json serializa um namedtuple como lista antes de chamar ``default``."""
+    tipo = type(obj)
+    if tipo in _SIMPLES:
+        return obj
+    conversor = _CONVERSORES.get(tipo)
+    if conversor is not None:
+        return conversor(obj)
+    if tipo is list:
+        return [_converter(v) for v in obj]
+    if isinstance(obj, dict):
+        return {k: _converter(v) for k, v in obj.items()}
+    if _e_namedtuple(obj):
+        return dict(zip(obj._fields, [_converter(v) for v in obj]))
+    if isinstance(obj, (list, tuple)):
+        return [_converter(v) for v in obj]
+    if isinstance(obj, (date, time, Decimal)):
+        # Subclasses dos tipos de _CONVERSORES.
+        return str(obj) if isinstance(obj, Decimal) else obj.isoformat()
+    return obj
+
+
+def codificar(obj, legivel=False, rapido=None):
+    """``obj`` em JSON, como bytes; com ``legivel``, indentado. ``rapido``
+    escolhe o orjson (por omissão, se estiver instalado)."""
+    if rapido is None:
+        rapido = orjson is not None
+    if rapido:
+        opcoes = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+        if legivel:
+            opcoes |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_padrao, option=opcoes)
+    if legivel:
+        formato = {"indent": 2}
+    else:
+        formato = {"separators": (",", ":")}
+    return json.dumps(
+        _converter(obj), sort_keys=True, ensure_ascii=False, default=DefaultJSONProvider.default, **formato
+    ).encode()
+
+
+class ProvedorJSON(DefaultJSONProvider):
+    """Provedor JSON do Flask com ``codificar``."""
+
+    rapido = orjson is not None
+
+    def _codificar(self, obj, legivel=False):
+        return codificar(obj, legivel, self.rapido)
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # Opções próprias de quem chama (json.dumps do Flask com indent,
+            # cls, ...): fica com o comportamento do provedor por omissão.
+            return super().dumps(_converter(obj), **kwargs)
+        return self._codificar(obj).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        legivel = self.compact is False or (self.compact is None and self._app.debug)
+        return self._app.response_class(self._codificar(obj, legivel) + b"\n", mimetype=self.mimetype)
+
+
+def init_app(app):
+    app.json = ProvedorJSON(app)
@@ -0,0 +1,334 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Validação dos pedidos de marcação e cancelamento.
+
+As verificações de formato correm em Python; tudo o que precisa da base de
+dados (paciente, médico, horário de trabalho e conflitos de horário) é
+respondido por uma única instrução SQL, numa só ida ao servidor.
+"""
+from datetime import datetime
+
+from agenda import GRELHA
+from preparadas import executar, executar_async, preparada
+
+# Nomes dos campos tal como chegam no corpo JSON dos pedidos.
+CAMPO_SSN = "ssn paciente"
+CAMPO_NIF = "nif medico"
+CAMPO_DATA = "data"
+CAMPO_HORA = "hora"
+
+VALIDAR_MARCACAO = preparada("validar_marcacao", '''
+    SELECT
+        EXISTS (
+            SELECT 1 FROM paciente WHERE ssn = %(ssn)s
+        ) AS paciente_existe,
+        EXISTS (
+            SELECT 1 FROM medico WHERE nif = %(nif)s
+        ) AS medico_existe,
+        EXISTS (
+            SELECT 1
+            FROM trabalha
+            WHERE
+                nif = %(nif)s AND
+                nome = %(clinica)s AND
+                dia_da_semana = EXTRACT(DOW FROM %(data)s::date)
+        ) AS medico_trabalha,
+        EXISTS (
+            SELECT 1
+            FROM consulta
+            WHERE nif = %(nif)s AND data = %(data)s AND hora = %(hora)s
+        ) AS medico_ocupado,
+        EXISTS (
+            SELECT 1
+            FROM consulta
+            WHERE ssn = %(ssn)s AND data = %(data)s AND hora = %(hora)s
+        ) AS paciente_ocupado;
+''')
+
+VALIDAR_LOTE = preparada("validar_lote", '''
+    SELECT
+        l.ord,
+        EXISTS (
+            SELECT 1 FROM paciente p WHERE p.ssn = l.ssn
+        ) AS paciente_existe,
+        EXISTS (
+            SELECT 1 FROM medico m WHERE m.nif = l.nif
+        ) AS medico_existe,
+        EXISTS (
+            SELECT 1
+            FROM trabalha tr
+            WHERE
+                tr.nif = l.nif AND
+                tr.nome = %(clinica)s AND
+                tr.dia_da_semana = EXTRACT(DOW FROM l.data)
+        ) AS medico_trabalha,
+        EXISTS (
+            SELECT 1
+            FROM consulta c
+            WHERE c.nif = l.nif AND c.data = l.data AND c.hora = l.hora
+        ) AS medico_ocupado,
+        EXISTS (
+            SELECT 1
+            FROM consulta c
+            WHERE c.ssn = l.ssn AND c.data = l.data AND c.hora = l.hora
+        ) AS paciente_ocupado
+    FROM unnest(%(ssn)s::text[], %(nif)s::text[], %(data)s::date[], %(hora)s::time[])
+        WITH ORDINALITY AS l(ssn, nif, data, hora, ord);
+''')
+
+# Depois de um MARCAR ou MARCAR_LOTE sem linha devolvida: confirma que o
+# horário do médico ou do paciente está mesmo ocupado (ver consultas.py).
+HORARIOS_TOMADOS = preparada("horarios_tomados", '''
+    SELECT
+        l.ord,
+        EXISTS (
+            SELECT 1
+            FROM consulta c
+            WHERE c.nif = l.nif AND c.data = l.data AND c.hora = l.hora
+        ) OR EXISTS (
+            SELECT 1
+            FROM consulta c
+            WHERE c.ssn = l.ssn AND c.data = l.data AND c.hora = l.hora
+        ) AS tomado
+    FROM unnest(%(ssn)s::text[], %(nif)s::text[], %(data)s::date[], %(hora)s::time[])
+        WITH ORDINALITY AS l(ssn, nif, data, hora, ord);
+''')
+
+VALIDAR_CANCELAMENTO = preparada("validar_cancelamento", '''
+    SELECT
+        EXISTS (
+            SELECT 1 FROM paciente WHERE ssn = %(ssn)s
+        ) AS paciente_existe,
+        EXISTS (
+            SELECT 1 FROM medico WHERE nif = %(nif)s
+        ) AS medico_existe;
+''')
+
+
+def confirma_data(data):
+    # Qualquer data do calendário; só marcar e cancelar exigem datas futuras
+    # (valida_formato). Aceitar só 2023 e 2024, os anos dos dados gerados,
+    # deixava de fora todas as marcações a partir de 2025.
+    try:
+        datetime.strptime(data, "%Y-%m-%d")
+        return True
+    except ValueError:
+        return False
+
+def confirma_hora(hora):
+    try:
+        # Converte a string de hora para um objeto datetime
+        hora_obj = datetime.strptime(hora, "%H:%M:%S")
+        return True
+    except ValueError:
+        # Se a conversão falhar, a hora é inválida
+        return False
+
+def isDepoisdeHj(data, hora):
+    data_obj = datetime.strptime(data, "%Y-%m-%d")
+    hora_obj = datetime.strptime(hora, "%H:%M:%S")
+    hj = datetime.now()
+    if data_obj.year > hj.year:
+        return True
+    elif data_obj.year == hj.year:
+        if data_obj.month > hj.month:
+            return True
+        elif data_obj.month == hj.month:
+            if data_obj.day > hj.day:
+                return True
+            elif data_obj.day == hj.day:
+                if hora_obj.hour > hj.hour:
+                    return True
+                elif hora_obj.hour == hj.hour:
+                    if hora_obj.minute > hj.minute:
+                        return True
+    return False
+
+
+def _erros_tipo(campos):
+    """Um erro por cada campo que veio no JSON com um valor que não é texto
+    (um número, uma lista, ...); os campos em falta (None) ficam para as
+    outras verificações."""
+    return {
+        campo: "O valor tem de ser uma string."
+        for campo, valor in campos.items()
+        if valor is not None and not isinstance(valor, str)
+    }
+
+
+def valida_formato(ssn, nif, data, hora, acao="marcar", so_futuras=True):
+    """Verifica os campos do pedido sem ir à base de dados. Com
+    ``so_futuras=False`` a regra de só aceitar datas futuras fica para quem
+    chama (os pedidos em lote aplicam-na no próprio SQL).
+
+    Devolve um dicionário ``{campo: mensagem}`` com um erro por cada campo
+    inválido (vazio se o pedido estiver bem formado).
+    """
+    erros = _erros_tipo({CAMPO_SSN: ssn, CAMPO_NIF: nif, CAMPO_DATA: data, CAMPO_HORA: hora})
+    if CAMPO_SSN not in erros and (not ssn or len(ssn) != 11 or not ssn.isdigit()):
+        erros[CAMPO_SSN] = "SSN doesn't exist."
+    if CAMPO_NIF not in erros and (not nif or len(nif) != 9 or not nif.isdigit()):
+        erros[CAMPO_NIF] = "Nif doesn't exist."
+    if CAMPO_DATA not in erros and (not data or not confirma_data(data)):
+        erros[CAMPO_DATA] = "Date doesn't exist."
+    if CAMPO_HORA not in erros:
+        if not hora or not confirma_hora(hora):
+            erros[CAMPO_HORA] = "Hour doesn't exist."
+        elif acao == "marcar" and datetime.strptime(hora, "%H:%M:%S").time() not in GRELHA:
+            erros[CAMPO_HORA] = "A hora tem de ser um horário de consulta (08:00-12:30 ou 14:00-18:30, de 30 em 30 minutos)."
+    if so_futuras and CAMPO_DATA not in erros and CAMPO_HORA not in erros and not isDepoisdeHj(data, hora):
+        erros[CAMPO_DATA] = f"So pode {acao} consulta para datas futuras."
+    return erros
+
+
+def valida_intervalo(nif, de, ate):
+    """Verifica um seletor ``(nif, de, ate)`` de cancelamento em lote."""
+    erros = _erros_tipo({CAMPO_NIF: nif, "de": de, "ate": ate})
+    if CAMPO_NIF not in erros and (not nif or len(nif) != 9 or not nif.isdigit()):
+        erros[CAMPO_NIF] = "Nif doesn't exist."
+    if "de" not in erros and (not de or not confirma_data(de)):
+        erros["de"] = "Date doesn't exist."
+    if "ate" not in erros and (not ate or not confirma_data(ate)):
+        erros["ate"] = "Date doesn't exist."
+    # Compara as datas e não o texto: "2024-1-5" é uma data válida, anterior
+    # a "2024-01-10", mas não como string.
+    if not erros.keys() & {"de", "ate"} and (
+        datetime.strptime(ate, "%Y-%m-%d") < datetime.strptime(de, "%Y-%m-%d")
+    ):
+        erros["ate"] = "A data final tem de ser igual ou posterior à inicial."
+    return erros
+
+
+# Marcação válida cujo horário outro pedido ocupou entre a validação e o
+# INSERT (ver MARCAR em consultas.py e ``confirma_tomados``); a resposta é um
+# 409.
+HORARIO_OCUPADO = {CAMPO_HORA: "O horário acabou de ser marcado por outro pedido."}
+
+
+def _erros_marcacao(r):
+    erros = {}
+    if not r.paciente_existe:
+        erros[CAMPO_SSN] = "SSN doesn't exist."
+    elif r.paciente_ocupado:
+        erros[CAMPO_SSN] = "O paciente já tem uma consulta a essa hora."
+    if not r.medico_existe:
+        erros[CAMPO_NIF] = "Nif doesn't exist."
+    elif not r.medico_trabalha:
+        erros[CAMPO_NIF] = "O médico não trabalha nessa clínica nesse dia."
+    elif r.medico_ocupado:
+        erros[CAMPO_HORA] = "O médico já tem uma consulta a essa hora."
+    return erros
+
+
+def valida_marcacao(cur, clinica, ssn, nif, data, hora):
+    """Valida na base de dados uma marcação já bem formada na <clinica>:
+    existência do paciente e do médico, se o médico trabalha na clínica nesse
+    dia da semana e se o horário está livre para ambos, numa única query."""
+    r = executar(
+        cur,
+        VALIDAR_MARCACAO,
+        {"clinica": clinica, "ssn": ssn, "nif": nif, "data": data, "hora": hora},
+    ).fetchone()
+    return _erros_marcacao(r)
+
+
+async def valida_marcacao_async(acur, clinica, ssn, nif, data, hora):
+    """``valida_marcacao`` para um cursor assíncrono (asgi.py)."""
+    await executar_async(
+        acur,
+        VALIDAR_MARCACAO,
+        {"clinica": clinica, "ssn": ssn, "nif": nif, "data": data, "hora": hora},
+    )
+    return _erros_marcacao(await acur.fetchone())
+
+
+def valida_lote(cur, clinica, marcacoes):
+    """Valida de uma vez uma lista de marcações bem formadas na <clinica>,
+    dadas como tuplos ``(ssn, nif, data, hora)``: as mesmas verificações de
+    ``valida_marcacao`` numa única query sobre os arrays do lote, mais os
+    conflitos entre marcações do próprio lote. Devolve uma lista de
+    dicionários de erros, pela ordem das marcações."""
+    if not marcacoes:
+        return []
+    ssns, nifs, datas, horas = (list(coluna) for coluna in zip(*marcacoes))
+    linhas = executar(
+        cur,
+        VALIDAR_LOTE,
+        {"clinica": clinica, "ssn": ssns, "nif": nifs, "data": datas, "hora": horas},
+    ).fetchall()
+
+    resultado = [_erros_marcacao(r) for r in sorted(linhas, key=lambda r: r.ord)]
+    medicos, pacientes = set(), set()
+    for (ssn, nif, data, hora), erros in zip(marcacoes, resultado):
+        if erros:
+            continue
+        if (nif, data, hora) in medicos:
+            erros[CAMPO_HORA] = "O médico já tem uma consulta a essa hora neste lote."
+        elif (ssn, data, hora) in pacientes:
+            erros[CAMPO_SSN] = "O paciente já tem uma consulta a essa hora neste lote."
+        else:
+            medicos.add((nif, data, hora))
+            pacientes.add((ssn, data, hora))
+    return resultado
+
+
+def _parametros_tomados(marcacoes):
+    ssns, nifs, datas, horas = (list(coluna) for coluna in zip(*marcacoes))
+    return {"ssn": ssns, "nif": nifs, "data": datas, "hora": horas}
+
+
+def horarios_livres(cur, marcacoes):
+    """Posições, na lista de marcações ``(ssn, nif, data, hora)`` que o
+    INSERT não inseriu, das que têm o horário livre para o médico e para o
+    paciente: o conflito foi noutro índice único (id, codigo_sns) e a
+    resposta não pode ser um 409."""
+    if not marcacoes:
+        return []
+    linhas = executar(cur, HORARIOS_TOMADOS, _parametros_tomados(marcacoes)).fetchall()
+    return [r.ord - 1 for r in linhas if not r.tomado]
+
+
+def confirma_tomados(cur, marcacoes):
+    """Levanta RuntimeError se alguma das marcações que o INSERT não inseriu
+    tiver o horário livre (ver ``horarios_livres``)."""
+    livres = [marcacoes[i] for i in horarios_livres(cur, marcacoes)]
+    if livres:
+        raise RuntimeError(f"Marcações não inseridas com o horário livre: {livres}")
+
+
+async def confirma_tomados_async(acur, marcacoes):
+    """``confirma_tomados`` para um cursor assíncrono (asgi.py)."""
+    if not marcacoes:
+        return
+    await executar_async(acur, HORARIOS_TOMADOS, _parametros_tomados(marcacoes))
+    livres = [marcacoes[r.ord - 1] for r in await acur.fetchall() if not r.tomado]
+    if livres:
+        raise RuntimeError(f"Marcações não inseridas com o horário livre: {livres}")
+
+
+def _erros_cancelamento(r):
+    erros = {}
+    if not r.paciente_existe:
+        erros[CAMPO_SSN] = "SSN doesn't exist."
+    if not r.medico_existe:
+        erros[CAMPO_NIF] = "Nif doesn't exist."
+    return erros
+
+
+def valida_cancelamento(cur, ssn, nif):
+    """Valida na base de dados um cancelamento já bem formado: existência do
+    paciente e do médico, numa única query."""
+    r = executar(cur, VALIDAR_CANCELAMENTO, {"ssn": ssn, "nif": nif}).fetchone()
+    return _erros_cancelamento(r)
+
+
+async def valida_cancelamento_async(acur, ssn, nif):
+    """``valida_cancelamento`` para um cursor assíncrono (asgi.py)."""
+    await executar_async(acur, VALIDAR_CANCELAMENTO, {"ssn": ssn, "nif": nif})
+    return _erros_cancelamento(await acur.fetchone())
+
+
+def resposta_erros(erros):
+    """Corpo JSON de erro: ``error`` mantém a mensagem única de sempre e
+    ``erros`` traz o detalhe por campo."""
+    return {"error": next(iter(erros.values())), "erros": erros}
@@ -1,4 +1,10 @@
 #!/usr/bin/python3
+"""Ponto de entrada WSGI. Em produção, com vários workers:
+
+    gunicorn --config gunicorn.conf.py wsgi:app
+
+Correr este ficheiro diretamente usa o servidor de desenvolvimento do Flask.
+"""
 from app import app
 
 if __name__ == "__main__":
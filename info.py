@@ -2,6 +2,13 @@ from faker import Faker
 import random
 from unidecode import unidecode
 from datetime import datetime, timedelta, time
+import os
+import sys
+
+# Partilha o gerador de códigos SNS com a API (app/codigos.py).
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app"))
+import codigos
+from agenda import Agenda
 
 # Gerador de dados
 fake = Faker('pt_PT')
@@ -140,8 +147,8 @@ def gerar_consultas_receitas(pacientes, medicos, clinicas, start_date, end_date,
     receitas = []
     consulta_id = 1
     delta_days = (end_date - start_date).days
-    patient_schedule = {p[0]: set() for p in pacientes}  # Dictionary to track each patient's schedule
-    doctor_schedule = {m[0]: set() for m in medicos}  # Dictionary to track each doctor's schedule
+    patient_schedule = Agenda(start_date, delta_days)  # Bitset por paciente e dia (app/agenda.py)
+    doctor_schedule = Agenda(start_date, delta_days)  # Bitset por médico e dia
     unique_receitas = set()
     
     for day_offset in range(delta_days):
@@ -165,7 +172,7 @@ def gerar_consultas_receitas(pacientes, medicos, clinicas, start_date, end_date,
                         break
 
                     hora = generate_random_time()  # Gera um horário dentro dos intervalos especificados
-                    paciente_disponiveis = [p for p in pacientes if (data, hora) not in patient_schedule[p[0]]]
+                    paciente_disponiveis = [p for p in pacientes if not patient_schedule.ocupado(p[0], data, hora)]
 
                     if not paciente_disponiveis:
                         break  # Interrompe se não houver pacientes disponíveis
@@ -174,14 +181,14 @@ def gerar_consultas_receitas(pacientes, medicos, clinicas, start_date, end_date,
                     if paciente[0] == medico[0]:  # Pula se o paciente for o mesmo que o médico
                         continue
 
-                    if (data, hora) in doctor_schedule[medico]:
+                    if doctor_schedule.ocupado(medico, data, hora):
                         continue  # Pula se o médico já tiver uma consulta neste horário
 
                     # Adiciona a nova consulta aos agendamentos
-                    patient_schedule[paciente[0]].add((data, hora))
-                    doctor_schedule[medico].add((data, hora))
+                    patient_schedule.ocupar(paciente[0], data, hora)
+                    doctor_schedule.ocupar(medico, data, hora)
 
-                    codigo_sns = fake.unique.bothify(text='############')
+                    codigo_sns = codigos.codigo_sns(consulta_id)
                     consultas.append((consulta_id, paciente[0], medico, clinica[0], data, hora, codigo_sns))
 
                     # ~80% das consultas têm receita
@@ -1,8 +1,15 @@
 from faker import Faker
+import argparse
 import random
 from unidecode import unidecode
 from datetime import datetime, timedelta, time
-import string
+import os
+import sys
+
+# Partilha o gerador de códigos SNS com a API (app/codigos.py).
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app"))
+import codigos
+from agenda import GRELHA, Agenda
 
 
 # Create a Faker instance
@@ -117,8 +124,18 @@ def generate_time():
     minute = random.choice(possible_minutes)
     return time(hour, minute, 0)  # Hours, minutes, and seconds set to 00
 
-def generate_codigo_sns():
-    return ''.join(random.choices(string.digits, k=12))
+def generate_tempo_data(start_date, end_date):
+    # Um registo por cada horário da grelha (app/agenda.py) de cada dia.
+    tempo_data = []
+    for day_offset in range((end_date - start_date).days + 1):
+        data = (start_date + timedelta(days=day_offset)).date()
+        for hora in GRELHA:
+            tempo_data.append((data.strftime('%Y-%m-%d'), hora.strftime('%H:%M:%S')))
+    return tempo_data
+
+def generate_codigo_sns(consulta_id):
+    # O id da consulta serve de contador: ids diferentes dão códigos diferentes.
+    return codigos.codigo_sns(consulta_id)
 
 
 def generate_receitas(consultas, prob_receita=0.8):
@@ -176,8 +193,8 @@ def gerar_consultas_receitas(pacientes, medicos, clinicas, start_date, end_date,
     consulta_id = 1
 
     delta_days = (end_date - start_date).days
-    patient_schedule = {p[0]: set() for p in pacientes}  # Dictionary to track each patient's schedule
-    doctor_schedule = {m[0]: set() for m in medicos}  # Dictionary to track each doctor's schedule
+    patient_schedule = Agenda(start_date, delta_days + 1)  # Bitset por paciente e dia (app/agenda.py)
+    doctor_schedule = Agenda(start_date, delta_days + 1)  # Bitset por médico e dia
     unique_receitas = set()
     paciente_especifico = pacientes[0]
 
@@ -205,21 +222,23 @@ def gerar_consultas_receitas(pacientes, medicos, clinicas, start_date, end_date,
                     while consultas_por_medico < 2:
 
                         hora = generate_time()  # Gera um horário dentro dos intervalos especificados
-                        paciente_disponiveis = [p for p in pacientes if (data, hora) not in patient_schedule[p[0]]]
-
-                        paciente = random.choice(paciente_disponiveis)
+                        # Sorteia até sair um paciente livre a esta hora, em vez de
+                        # filtrar todos os pacientes a cada consulta.
+                        paciente = random.choice(pacientes)
+                        while patient_schedule.ocupado(paciente[0], data, hora):
+                            paciente = random.choice(pacientes)
 
                         # Pula se o médico já tiver uma consulta neste horário
                         # Pula se o paciente for o mesmo que o médico
                             
-                        if paciente[0] == medico[0] or (data, hora) in doctor_schedule[medico]:  
+                        if paciente[0] == medico[0] or doctor_schedule.ocupado(medico, data, hora):
                             continue
 
                         # Adiciona a nova consulta aos agendamentos
-                        patient_schedule[paciente[0]].add((data, hora))
-                        doctor_schedule[medico].add((data, hora))
+                        patient_schedule.ocupar(paciente[0], data, hora)
+                        doctor_schedule.ocupar(medico, data, hora)
 
-                        codigo_sns = fake.unique.bothify(text='############')
+                        codigo_sns = generate_codigo_sns(consulta_id)
                         consultas.append((consulta_id, paciente[0], medico, clinica[0], data.strftime('%Y-%m-%d'), hora.strftime('%H:%M:%S'), codigo_sns))
 
                         # ~80% das consultas têm receita
@@ -245,33 +264,35 @@ def gerar_consultas_receitas(pacientes, medicos, clinicas, start_date, end_date,
                 if consultas_por_clinica >= 20:
                     break
 
+    # Filtra trabalha por dia da semana
+    trabalha_por_dia = {dia: [] for dia in range(7)}
+    for item in trabalha:
+        if item not in trabalha_por_dia[item[2]]:
+            trabalha_por_dia[item[2]].append(item)
+
+    pacientes_com_consulta = {consulta[1] for consulta in consultas}
     for paciente in pacientes:
-        if not any(paciente[0] == consulta[1] for consulta in consultas): # if paciente doesnt have any consulta yet
+        if paciente[0] not in pacientes_com_consulta: # if paciente doesnt have any consulta yet
             consulta_date = start_date + timedelta(days=random.randint(0, delta_days))
-            day_of_week = (data.isoweekday()) % 7
+            day_of_week = (consulta_date.isoweekday()) % 7
             hora = generate_time()
+            trabalha_dia = trabalha_por_dia[day_of_week]
 
-            # Filtra trabalha por dia da semana
-            trabalha_dia = []
-            for item in trabalha:
-                if item[2] == day_of_week and item not in trabalha_dia:
-                    trabalha_dia.append(item)
-            
             # Seleciona um trabalha aleatório
             trabalha_item = random.choice(trabalha_dia)
             medico = trabalha_item[0]
 
-            while paciente[0] == medico or ((consulta_date, hora) in patient_schedule[paciente[0]]) \
-                or ((consulta_date, hora) in doctor_schedule[medico]):
+            while paciente[0] == medico or patient_schedule.ocupado(paciente[0], consulta_date, hora) \
+                or doctor_schedule.ocupado(medico, consulta_date, hora):
                 trabalha_item = random.choice(trabalha_dia)
                 medico = trabalha_item[0]
                 hora = generate_time()
 
-            patient_schedule[paciente[0]].add((consulta_date, hora))
-            doctor_schedule[medico].add((consulta_date, hora))
+            patient_schedule.ocupar(paciente[0], consulta_date, hora)
+            doctor_schedule.ocupar(medico, consulta_date, hora)
 
-            consulta = (len(consultas) + 1, paciente[0], medico[0], trabalha_item[1],
-                        consulta_date.strftime('%Y-%m-%d'), time.strftime('%H:%M:%S'), generate_codigo_sns())
+            consulta = (len(consultas) + 1, paciente[0], medico, trabalha_item[1],
+                        consulta_date.strftime('%Y-%m-%d'), hora.strftime('%H:%M:%S'), generate_codigo_sns(len(consultas) + 1))
     
             consultas.append(consulta)
     
@@ -279,19 +300,14 @@ def gerar_consultas_receitas(pacientes, medicos, clinicas, start_date, end_date,
 
 
 
-
-fgit status
-
-
-
-def main():
-    num_clinics = 5 
+def gerar_dados(num_clinics=5, num_patients=5000, num_doctors=60,
+                start_date=datetime(2023, 1, 1), end_date=datetime(2024, 12, 31)):
+    """Gera todas as tabelas; devolve um dicionário tabela -> linhas, pela
+    ordem em que têm de ser inseridas. As observações estão separadas em
+    ``observacao_sintoma`` (id, parametro) e ``observacao_metrica`` (id,
+    parametro, valor)."""
     clinic_data = generate_clinic_data(num_clinics)
-    print("INSERT INTO clinica VALUES", ",".join(str(clinic) for clinic in clinic_data) + ";")
-
-    num_patients = 5000
     patients = generate_patient_data(num_patients)
-    print("INSERT INTO paciente VALUES", ",".join(str(patient) for patient in patients) + ";")
 
     nurse_data_all = []
     for clinic in clinic_data:
@@ -299,19 +315,65 @@ def main():
         num_nurses = fake.random_int(min=5, max=6)
         nurse_data = generate_nurse_data(clinic_name, num_nurses)
         nurse_data_all.extend(nurse_data)
-    print("INSERT INTO enfermeiro VALUES", ",".join(str(nurse) for nurse in nurse_data_all) + ";")
 
-    num_doctors = 60
     doctor_data = generate_doctor_data(num_doctors)
-    print("INSERT INTO medico VALUES", ",".join(str(doctor) for doctor in doctor_data) + ";")
-
     works_data = generate_works_data(doctor_data, clinic_data)
-    print("INSERT INTO trabalha VALUES", ",".join(str(work) for work in works_data) + ";")
 
-    start_date = datetime(2023, 1, 1)
-    end_date = datetime(2024, 12, 31)
     consultas, receitas =  gerar_consultas_receitas(patients, doctor_data, clinic_data, start_date, end_date, works_data)
     observacoes_sintomas, observacoes_metricas = generate_observacoes(consultas)
+
+    return {
+        "clinica": clinic_data,
+        "paciente": patients,
+        "enfermeiro": nurse_data_all,
+        "medico": doctor_data,
+        "trabalha": works_data,
+        "consulta": consultas,
+        "receita": receitas,
+        "observacao_sintoma": observacoes_sintomas,
+        "observacao_metrica": observacoes_metricas,
+        "tempo": generate_tempo_data(start_date, end_date),
+    }
+
+
+def escalar(escala):
+    """Número de clínicas, pacientes e médicos para uma escala (1 = o conjunto
+    de dados original: 5 clínicas, 5000 pacientes e 60 médicos)."""
+    # Cada médico trabalha em 2 clínicas e cada clínica precisa de pelo menos
+    # 8 médicos (generate_works_data); os 20 primeiros são de clínica geral.
+    num_clinics = max(2, round(5 * escala))
+    return {
+        "num_clinics": num_clinics,
+        "num_patients": max(100, round(5000 * escala)),
+        "num_doctors": max(20 + 4 * num_clinics, round(60 * escala)),
+    }
+
+
+def argumentos(parser):
+    """Opções de escala e período, partilhadas com app/bench/carga.py."""
+    parser.add_argument("--escala", type=float, default=1, help="multiplicador do tamanho do conjunto de dados")
+    parser.add_argument("--inicio", type=datetime.fromisoformat, default=datetime(2023, 1, 1), help="primeiro dia das consultas")
+    parser.add_argument("--fim", type=datetime.fromisoformat, default=datetime(2024, 12, 31), help="último dia das consultas")
+    parser.add_argument("--semente", type=int, default=None, help="semente dos geradores, para repetir o mesmo conjunto de dados")
+    return parser
+
+
+def semear(semente):
+    if semente is not None:
+        random.seed(semente)
+        Faker.seed(semente)
+
+
+def main():
+    args = argumentos(argparse.ArgumentParser(description="Gera o conjunto de dados em SQL.")).parse_args()
+    semear(args.semente)
+    dados = gerar_dados(start_date=args.inicio, end_date=args.fim, **escalar(args.escala))
+
+    for tabela in ("clinica", "paciente", "enfermeiro", "medico", "trabalha"):
+        print(f"INSERT INTO {tabela} VALUES", ",".join(str(linha) for linha in dados[tabela]) + ";")
+
+    consultas, receitas = dados["consulta"], dados["receita"]
+    observacoes_sintomas, observacoes_metricas = dados["observacao_sintoma"], dados["observacao_metrica"]
     # Define uma função para imprimir uma lista de consultas
     def print_consultas(consultas):
         print("INSERT INTO consulta VALUES ", end="")
@@ -345,12 +407,6 @@ def main():
     for i in range(0, len(observacoes_metricas), 20000):
         print_observacoes_metricas(observacoes_metricas[i:i+20000])
 
-
-    tart_date = datetime(2023, 1, 1)
-    end_date = datetime(2024, 12, 31)
-
-    tempo_data = generate_tempo_data(start_date, end_date)
-
     def print_tempo_data(tempo_data, chunk_size=20000):
         def print_chunk(chunk):
             print("INSERT INTO tempo (data, hora) VALUES ", end="")
@@ -359,7 +415,7 @@ def main():
         for i in range(0, len(tempo_data), chunk_size):
             print_chunk(tempo_data[i:i+chunk_size])
 
-    print_tempo_data(tempo_data)
+    print_tempo_data(dados["tempo"])
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()